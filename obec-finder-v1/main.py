@@ -1,11 +1,33 @@
+import sys
 import time
 import csv
 import os
 import re
+import threading
+import bisect
+import heapq
+import itertools
+import unicodedata
+import io
+import hashlib
+from collections import OrderedDict
+from contextlib import contextmanager, asynccontextmanager
 import psycopg2
-from fastapi import FastAPI, HTTPException, Query
+from psycopg2 import pool as pg_pool
+from psycopg_pool import AsyncConnectionPool, PoolTimeout
+import json
+import glob
+import struct
+from array import array
+import zlib
+import signal
+import asyncio
+from fastapi import FastAPI, HTTPException, Query, Request
+from pydantic import ValidationError
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST, Histogram, generate_latest
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional, Union
 
 app = FastAPI()
 
@@ -40,6 +62,9 @@ class LocationCreate(BaseModel):
     parent_kod: str        
     identifikatory: List[Identifikator] = []
 
+class LocationMove(BaseModel):
+    novy_parent_kod: str
+
 # -------------------------------------------------
 
 # --- POMOCNÉ FUNKCE ---
@@ -57,14 +82,210 @@ def normalizovat_okres(okres_str):
     return re.sub(r'\s*-\s*', '-', okres_str.strip())
 
 
+# --- HROMADNÉ NAHRÁVÁNÍ (COPY) ---
+def copy_do_tabulky(cursor, tabulka, sloupce, radky):
+    """
+    Nasype řádky do tabulky jedním COPY místo INSERTu na každý řádek.
+    NULL je nekvotované prázdné pole (výchozí u FORMAT csv), každá jiná hodnota je v uvozovkách,
+    takže "" je prázdný řetězec a žádný text z dat (ani \\N) se za NULL nepovažuje.
+    """
+    buffer = io.StringIO()
+    for radek in radky:
+        buffer.write(",".join(
+            '' if hodnota is None else '"' + str(hodnota).replace('"', '""') + '"' for hodnota in radek
+        ) + "\n")
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {tabulka} ({', '.join(sloupce)}) FROM STDIN WITH (FORMAT csv);", buffer)
+    return cursor.rowcount
+
+def copy_do_stagingu(cursor, tabulka, sloupce, radky):
+    """Založí dočasnou staging tabulku (textové sloupce + pořadí řádku) a naplní ji přes COPY."""
+    cursor.execute(f"DROP TABLE IF EXISTS {tabulka};")
+    definice = ", ".join(f"{s} text" for s in sloupce)
+    cursor.execute(f"CREATE TEMP TABLE {tabulka} (poradi integer, {definice}) ON COMMIT DROP;")
+    return copy_do_tabulky(cursor, tabulka, ['poradi'] + list(sloupce), (
+        (poradi, *radek) for poradi, radek in enumerate(radky)
+    ))
+
+def hash_souboru(*cesty):
+    """SHA-256 obsahu zdrojových souborů; None, pokud některý chybí."""
+    h = hashlib.sha256()
+    try:
+        for cesta in cesty:
+            with open(cesta, 'rb') as f:
+                for blok in iter(lambda: f.read(1 << 20), b''):
+                    h.update(blok)
+    except FileNotFoundError:
+        return None
+    return h.hexdigest()
+
+def zdroj_zmenen(cursor, zdroj, hash_zdroje):
+    """True, pokud se zdrojové CSV od poslední synchronizace změnilo (nebo ještě nebylo nahráno)."""
+    if hash_zdroje is None:
+        return False
+    cursor.execute("SELECT hash FROM zdroje_stav WHERE zdroj = %s;", (zdroj,))
+    row = cursor.fetchone()
+    return row is None or row[0] != hash_zdroje
+
+def synchronizovat_ids(cursor, zdroj, hash_zdroje, typy, radky):
+    """
+    Porovná požadovaný stav identifikátorů daných typů (radky = (location_pk, value, type, priority))
+    s tabulkou ids a provede jen rozdíl: smaže zmizelé, vloží nové a přepíše změněné priority.
+    Maže a mění jen řádky, které tenhle zdroj sám vložil (ids.zdroj) - identifikátory
+    zadané přes API (zdroj NULL) nechává být. Vše běží v transakci volajícího.
+    Vrací (vlozeno, smazano, zmeneno).
+    """
+    copy_do_stagingu(cursor, 'stg_ids', ['location_pk', 'value', 'type', 'priority'], radky)
+    cursor.execute("""
+        CREATE TEMP TABLE stg_ids_cil ON COMMIT DROP AS
+        SELECT DISTINCT ON (location_pk::int, value, type)
+               location_pk::int AS location_pk, value, type, priority::int AS priority
+        FROM stg_ids
+        ORDER BY location_pk::int, value, type, poradi;
+        DROP TABLE stg_ids;
+        ANALYZE stg_ids_cil;
+    """)
+
+    cursor.execute("SELECT 1 FROM zdroje_stav WHERE zdroj = %s;", (zdroj,))
+    if cursor.fetchone() is None:
+        # první synchronizace zdroje (nebo db z doby před sloupcem zdroj):
+        # řádky bez zdroje, které přesně odpovídají datům zdroje, patří jemu
+        cursor.execute("""
+            UPDATE ids i SET zdroj = %s
+            FROM stg_ids_cil s
+            WHERE i.zdroj IS NULL
+              AND s.location_pk = i.location_pk AND s.value = i.value AND s.type = i.type;
+        """, (zdroj,))
+
+    cursor.execute("""
+        DELETE FROM ids i
+        WHERE i.zdroj = %s
+          AND i.type = ANY(%s)
+          AND NOT EXISTS (
+              SELECT 1 FROM stg_ids_cil s
+              WHERE s.location_pk = i.location_pk AND s.value = i.value AND s.type = i.type
+          );
+    """, (zdroj, typy))
+    smazano = cursor.rowcount
+
+    cursor.execute("""
+        UPDATE ids i SET priority = s.priority
+        FROM stg_ids_cil s
+        WHERE i.zdroj = %s
+          AND s.location_pk = i.location_pk AND s.value = i.value AND s.type = i.type
+          AND i.priority IS DISTINCT FROM s.priority;
+    """, (zdroj,))
+    zmeneno = cursor.rowcount
+
+    cursor.execute("""
+        INSERT INTO ids (location_pk, value, type, priority, zdroj)
+        SELECT s.location_pk, s.value, s.type, s.priority, %s
+        FROM stg_ids_cil s
+        ON CONFLICT (location_pk, type, value) DO NOTHING;
+    """, (zdroj,))
+    vlozeno = cursor.rowcount
+
+    cursor.execute("DROP TABLE stg_ids_cil;")
+    cursor.execute("""
+        INSERT INTO zdroje_stav (zdroj, hash, aktualizovano) VALUES (%s, %s, now())
+        ON CONFLICT (zdroj) DO UPDATE SET hash = EXCLUDED.hash, aktualizovano = EXCLUDED.aktualizovano;
+    """, (zdroj, hash_zdroje))
+
+    print(f"Synchronizace {zdroj}: +{vlozeno} / -{smazano} / změněná priorita {zmeneno}")
+    return vlozeno, smazano, zmeneno
+
+def vlozit_uzly(cursor, zdroj_sql, typ_uzlu, typ_kodu=None, priorita_kodu=None):
+    """
+    Vloží uzly set-wise jedním příkazem. zdroj_sql je SELECT se sloupci
+    (poradi, parent_id, nazev, kod); pk_id se přidělí ze sekvence předem,
+    takže ltree_path = cesta rodiče + pk_id se spočítá hned při vložení.
+    Vrací počet vložených uzlů.
+    """
+    cursor.execute(f"""
+        WITH zdroj AS ({zdroj_sql}),
+        nove AS (
+            SELECT nextval(pg_get_serial_sequence('geo_locations', 'pk_id'))::int AS pk_id,
+                   z.parent_id, z.nazev, z.kod
+            FROM zdroj z
+            ORDER BY z.poradi
+        ),
+        uzly AS (
+            INSERT INTO geo_locations (pk_id, parent_id, typ, nazev, ltree_path)
+            SELECT n.pk_id, n.parent_id, %(typ_uzlu)s, n.nazev,
+                   CASE WHEN n.parent_id IS NULL THEN n.pk_id::text::ltree
+                        ELSE p.ltree_path || n.pk_id::text END
+            FROM nove n
+            LEFT JOIN geo_locations p ON p.pk_id = n.parent_id
+            RETURNING pk_id
+        ),
+        kody AS (
+            INSERT INTO ids (location_pk, value, type, priority)
+            SELECT n.pk_id, n.kod, %(typ_kodu)s, %(priorita_kodu)s
+            FROM nove n
+            WHERE %(typ_kodu)s IS NOT NULL AND n.kod IS NOT NULL
+        )
+        SELECT count(*) FROM uzly;
+    """, {"typ_uzlu": typ_uzlu, "typ_kodu": typ_kodu, "priorita_kodu": priorita_kodu})
+    return cursor.fetchone()[0]
+
+
 # --- PARSOVACÍ FUNKCE ---
+def nahrat_strom(cursor):
+    """Kraje a okresy z MAPA_KRAJU, obce z VAZ0043 (s LAU2) - každá úroveň jedním příkazem."""
+    # 1. Kraje
+    copy_do_stagingu(cursor, 'stg_kraje', ['nazev'], ((kraj,) for kraj in MAPA_KRAJU))
+    vlozit_uzly(cursor, "SELECT poradi, NULL::int AS parent_id, nazev, NULL::text AS kod FROM stg_kraje", 'KRAJ')
+
+    # 2. Okresy (rodič podle názvu kraje)
+    copy_do_stagingu(cursor, 'stg_okresy', ['kraj', 'nazev'], (
+        (kraj, okres) for kraj, okresy in MAPA_KRAJU.items() for okres in okresy
+    ))
+    vlozit_uzly(cursor, """
+        SELECT s.poradi, k.pk_id AS parent_id, s.nazev, NULL::text AS kod
+        FROM stg_okresy s
+        JOIN geo_locations k ON k.typ = 'KRAJ' AND k.nazev = s.kraj
+    """, 'OKRES')
+
+    # okres se páruje v Pythonu: lower() v SQL závisí na locale db (v "C" neumí Č, Ú, Ž...)
+    cursor.execute("SELECT nazev, pk_id FROM geo_locations WHERE typ = 'OKRES';")
+    okresy_db = {nazev.lower(): pk_id for nazev, pk_id in cursor.fetchall()}
+
+    # 3. Obce z VAZ s přiřazením ZUJ (LAU2) do správného okresu
+    try:
+        with open('tabulky/VAZ0043_0101_CS.csv', 'r', encoding='utf-8') as f:
+            reader = csv.reader(f)
+            next(reader)
+
+            obce = []
+            for row in reader:
+                # Sloupec 4 je ZUJ, 5 je Obec, 9 je Okres
+                zuj = row[4]
+                nazev_obce = vycistit_nazev(row[5])
+                nazev_okresu = normalizovat_okres(row[9]).lower()
+
+                if "hlavní město praha" in nazev_okresu:
+                    nazev_okresu = "praha"
+
+                parent_okres_id = okresy_db.get(nazev_okresu)
+                if parent_okres_id:
+                    obce.append((parent_okres_id, nazev_obce, zuj))
+
+        copy_do_stagingu(cursor, 'stg_obce', ['parent_id', 'nazev', 'kod'], obce)
+        vlozeno = vlozit_uzly(cursor, """
+            SELECT s.poradi, s.parent_id::int AS parent_id, s.nazev, s.kod
+            FROM stg_obce s
+        """, 'OBEC', 'LAU2', 100)
+        print(f"Strom a LAU2 kódy byly úspěšně nahrány pro {vlozeno} obcí.")
+    except FileNotFoundError:
+        pass
+
 def nahrat_ico(cursor):
     """Nahrání IČO pomocí složeného klíče (Název obce + Název okresu)"""
     print("Kontroluji IČO data...")
-    
-    cursor.execute("SELECT count(*) FROM ids WHERE type='ICO';")
-    if cursor.fetchone()[0] > 0:
-        print("IČO data už v databázi jsou")
+
+    hash_zdroje = hash_souboru('tabulky/uzemni-samosprava_obce_30-11-2025.csv')
+    if not zdroj_zmenen(cursor, 'ICO', hash_zdroje):
+        print("IČO data jsou aktuální")
         return
 
     cursor.execute("""
@@ -75,7 +296,7 @@ def nahrat_ico(cursor):
     """)
     obce_mapa = {(row[0].lower(), row[1].lower()): row[2] for row in cursor.fetchall()}
         
-    vlozeno = 0
+    radky = []
     try:
         with open('tabulky/uzemni-samosprava_obce_30-11-2025.csv', 'r', encoding='utf-8') as f:
             reader = csv.reader(f, delimiter=';')
@@ -94,10 +315,10 @@ def nahrat_ico(cursor):
                 pk_id = obce_mapa.get((nazev_obce, nazev_okresu))
                 
                 if pk_id:
-                    cursor.execute("INSERT INTO ids (location_pk, value, type, priority) VALUES (%s, %s, 'ICO', 80);", (pk_id, ico))
-                    vlozeno += 1
-                    
-        print(f"IČO úspěšně nahráno a jmenovci vyřešeni. Spárováno: {vlozeno}")
+                    radky.append((pk_id, ico, 'ICO', 80))
+
+        synchronizovat_ids(cursor, 'ICO', hash_zdroje, ['ICO'], radky)
+        print(f"IČO úspěšně nahráno a jmenovci vyřešeni. Spárováno: {len(radky)}")
     except FileNotFoundError:
         pass
 
@@ -105,9 +326,9 @@ def nahrat_cis_kody(cursor):
     """Přečte CIS soubory a nalepí IDs na Kraje a Okresy"""
     print("Kontroluji data pro Kraje a Okresy (CIS)...")
     
-    cursor.execute("SELECT count(*) FROM ids WHERE type IN ('NUTS3', 'LAU1', 'RUIAN');")
-    if cursor.fetchone()[0] > 0:
-        print("Data pro Kraje a Okresy už v databázi jsou")
+    hash_zdroje = hash_souboru('tabulky/CIS0100_CS.csv', 'tabulky/CIS0101_CS.csv')
+    if not zdroj_zmenen(cursor, 'CIS', hash_zdroje):
+        print("Data pro Kraje a Okresy jsou aktuální")
         return
 
     cursor.execute("SELECT typ, nazev, pk_id FROM geo_locations WHERE typ IN ('KRAJ', 'OKRES');")
@@ -116,6 +337,7 @@ def nahrat_cis_kody(cursor):
     if ('OKRES', 'Hlavní město Praha') in db_uzly:
         db_uzly[('OKRES', 'Praha')] = db_uzly[('OKRES', 'Hlavní město Praha')]
 
+    radky = []
     try:
         # CIS0100
         with open('tabulky/CIS0100_CS.csv', 'r', encoding='utf-8') as f:
@@ -126,7 +348,7 @@ def nahrat_cis_kody(cursor):
                 if nazev == "Extra-Regio": continue
                 pk_id = db_uzly.get(('KRAJ', nazev))
                 if pk_id:
-                    cursor.execute("INSERT INTO ids (location_pk, value, type, priority) VALUES (%s, %s, %s, %s);", (pk_id, row[8], 'NUTS3', 80))
+                    radky.append((pk_id, row[8], 'NUTS3', 80))
     except FileNotFoundError:
         pass
 
@@ -141,17 +363,19 @@ def nahrat_cis_kody(cursor):
                 pk_id = db_uzly.get(('OKRES', nazev))
                 if pk_id:
                     # Sloupec 9 = okres_lau, Sloupec 11 = kod_ruian
-                    cursor.execute("INSERT INTO ids (location_pk, value, type, priority) VALUES (%s, %s, %s, %s);", (pk_id, row[9], 'LAU1', 80))
-                    cursor.execute("INSERT INTO ids (location_pk, value, type, priority) VALUES (%s, %s, %s, %s);", (pk_id, row[11], 'RUIAN', 80))
+                    radky.append((pk_id, row[9], 'LAU1', 80))
+                    radky.append((pk_id, row[11], 'RUIAN', 80))
     except FileNotFoundError:
         pass
 
+    synchronizovat_ids(cursor, 'CIS', hash_zdroje, ['NUTS3', 'LAU1', 'RUIAN'], radky)
+
 def nahrat_wikidata_qcodes(cursor):
-    """Přečte stažené CSV, napáruje Q-kódy a GeoNames IDs (s ochranou proti duplicitám)."""
+    """Přečte stažené CSV, napáruje Q-kódy a GeoNames IDs (duplicity zahodí unikátní index v db)."""
     print("Kontroluji Wikidata Q-kódy a GeoNames IDs...")
     
-    cursor.execute("SELECT count(*) FROM ids WHERE type='QCODE';")
-    if cursor.fetchone()[0] > 0:
+    hash_zdroje = hash_souboru('tabulky/wikidata_obce.csv')
+    if not zdroj_zmenen(cursor, 'WIKIDATA', hash_zdroje):
         return
 
     cursor.execute("SELECT count(*) FROM geo_locations WHERE typ='OBEC';")
@@ -162,13 +386,7 @@ def nahrat_wikidata_qcodes(cursor):
 
     sparovane_pk = set()
     nesparovane_wikidata = []
-    
-    # Paměť, abychom nevkládali duplicity
-    vlozene_qcodes = set()
-    vlozene_geonames = set()
-    
-    pocet_qcodes = 0
-    pocet_geonames = 0
+    radky = []
 
     try:
         with open('tabulky/wikidata_obce.csv', 'r', encoding='utf-8') as f:
@@ -182,30 +400,23 @@ def nahrat_wikidata_qcodes(cursor):
                 if lau2 in lau2_mapa:
                     pk_lokace = lau2_mapa[lau2]
                     
-                    # 1. Vložení Q-kódu (POUZE POKUD TAM JEŠTĚ NENÍ)
-                    qcode_klic = (pk_lokace, qcode)
-                    if qcode_klic not in vlozene_qcodes:
-                        cursor.execute(
-                            "INSERT INTO ids (location_pk, value, type, priority) VALUES (%s, %s, %s, %s);",
-                            (pk_lokace, qcode, 'QCODE', 90)
-                        )
-                        vlozene_qcodes.add(qcode_klic)
-                        pocet_qcodes += 1
-                        sparovane_pk.add(pk_lokace)
+                    # 1. Vložení Q-kódu
+                    radky.append((pk_lokace, qcode, 'QCODE', 90))
+                    sparovane_pk.add(pk_lokace)
                     
-                    # 2. Vložení GeoNames ID (POUZE POKUD TAM JEŠTĚ NENÍ)
+                    # 2. Vložení GeoNames ID
                     if geonames:
-                        geonames_klic = (pk_lokace, geonames)
-                        if geonames_klic not in vlozene_geonames:
-                            cursor.execute(
-                                "INSERT INTO ids (location_pk, value, type, priority) VALUES (%s, %s, %s, %s);",
-                                (pk_lokace, geonames, 'GEONAMES', 70)
-                            )
-                            vlozene_geonames.add(geonames_klic)
-                            pocet_geonames += 1
+                        radky.append((pk_lokace, geonames, 'GEONAMES', 70))
                 else:
                     nesparovane_wikidata.append((qcode, lau2))
-                    
+
+        synchronizovat_ids(cursor, 'WIKIDATA', hash_zdroje, ['QCODE', 'GEONAMES'], radky)
+
+        cursor.execute("SELECT type, count(*) FROM ids WHERE type IN ('QCODE', 'GEONAMES') GROUP BY type;")
+        pocty = dict(cursor.fetchall())
+        pocet_qcodes = pocty.get('QCODE', 0)
+        pocet_geonames = pocty.get('GEONAMES', 0)
+
         # Počítáme úspěšnost podle unikátních obcí, které dostaly alespoň nějaký kód
         uspesnost = (len(sparovane_pk) / celkem_obci_v_db) * 100 if celkem_obci_v_db > 0 else 0
         
@@ -229,50 +440,22 @@ def nahrat_mestske_casti(cursor):
     if cursor.fetchone()[0] > 0:
         return
 
-    # mapa LAU2 kódů na primární klíče a cesty existujících obci
-    cursor.execute("""
-        SELECT i.value, gl.pk_id, gl.ltree_path 
-        FROM ids i 
-        JOIN geo_locations gl ON i.location_pk = gl.pk_id 
-        WHERE i.type = 'LAU2' AND gl.typ = 'OBEC';
-    """)
-    obce_podle_lau2 = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
-
-    vlozeno = 0
     try:
-        # Soubor s vazbami MOMC -> LAU2
+        # Soubor s vazbami MOMC -> LAU2 (sloupec 4 = kód MČ, 5 = název MČ, 8 = LAU2 mateřské obce)
         with open('tabulky/VAZ0044_0043_CS-2.csv', 'r', encoding='utf-8') as f:
             reader = csv.reader(f)
             next(reader)
-            
-            for row in reader:
-                kod_momc = row[4]        # Kód městské části
-                nazev_mc = row[5]        # Název městské části
-                kod_lau2_matky = row[8]  # LAU2 kód mateřské obce
-                
-                matka_data = obce_podle_lau2.get(kod_lau2_matky)
-                
-                if matka_data:
-                    parent_pk, parent_ltree = matka_data
-                    
-                    # 1.vlozeni do geo_locations pod rodice
-                    cursor.execute(
-                        "INSERT INTO geo_locations (parent_id, typ, nazev) VALUES (%s, 'MESTSKA_CAST', %s) RETURNING pk_id;", 
-                        (parent_pk, nazev_mc)
-                    )
-                    mc_pk = cursor.fetchone()[0]
-                    
-                    # 2. nastaveni ltree cesty
-                    nova_cesta = f"{parent_ltree}.{mc_pk}"
-                    cursor.execute("UPDATE geo_locations SET ltree_path = %s WHERE pk_id = %s;", (nova_cesta, mc_pk))
-                    
-                    # 3. pridani momc do ids
-                    cursor.execute(
-                        "INSERT INTO ids (location_pk, value, type, priority) VALUES (%s, %s, 'MOMC', 90);", 
-                        (mc_pk, kod_momc)
-                    )
-                    vlozeno += 1
-                    
+            copy_do_stagingu(cursor, 'stg_mestske_casti', ['kod', 'nazev', 'kod_lau2'], (
+                (row[4], row[5], row[8]) for row in reader
+            ))
+
+        # zavěšení pod mateřskou obec podle LAU2 + kód MOMC do ids, vše jedním příkazem
+        vlozeno = vlozit_uzly(cursor, """
+            SELECT s.poradi, gl.pk_id AS parent_id, s.nazev, s.kod
+            FROM stg_mestske_casti s
+            JOIN ids i ON i.type = 'LAU2' AND i.value = s.kod_lau2
+            JOIN geo_locations gl ON gl.pk_id = i.location_pk AND gl.typ = 'OBEC'
+        """, 'MESTSKA_CAST', 'MOMC', 90)
         print(f"Městské části úspěšně nahrány. Zavěšeno {vlozeno} uzlů do stromu.")
     except FileNotFoundError:
         print("Chyba: Soubor tabulky/VAZ0044_0043_CS-2.csv nenalezen.")
@@ -286,49 +469,21 @@ def nahrat_casti_obci(cursor):
     if cursor.fetchone()[0] > 0:
         return
 
-    # mapa existujících obci podle jejich LAU2
-    cursor.execute("""
-        SELECT i.value, gl.pk_id, gl.ltree_path 
-        FROM ids i 
-        JOIN geo_locations gl ON i.location_pk = gl.pk_id 
-        WHERE i.type = 'LAU2' AND gl.typ = 'OBEC';
-    """)
-    obce_podle_lau2 = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
-
-    vlozeno = 0
     try:
+        # sloupec 4 = kód části obce, 5 = název části obce, 8 = LAU2 mateřské obce
         with open('tabulky/VAZ0042_0043_CS.csv', 'r', encoding='utf-8') as f:
             reader = csv.reader(f)
             next(reader)
-            
-            for row in reader:
-                kod_co = row[4]          # Kód části obce
-                nazev_co = row[5]        # Název části obce
-                kod_lau2_matky = row[8]  # LAU2 kód mateřské obce
-                
-                matka_data = obce_podle_lau2.get(kod_lau2_matky)
-                
-                if matka_data:
-                    parent_pk, parent_ltree = matka_data
-                    
-                    # 1. vlozeni casti obce do geo_locations pod matku
-                    cursor.execute(
-                        "INSERT INTO geo_locations (parent_id, typ, nazev) VALUES (%s, 'CAST_OBCE', %s) RETURNING pk_id;", 
-                        (parent_pk, nazev_co)
-                    )
-                    co_pk = cursor.fetchone()[0]
-                    
-                    # 2. nastaveni ltree cesty
-                    nova_cesta = f"{parent_ltree}.{co_pk}"
-                    cursor.execute("UPDATE geo_locations SET ltree_path = %s WHERE pk_id = %s;", (nova_cesta, co_pk))
-                    
-                    # 3. pridani kodu části obce do ids
-                    cursor.execute(
-                        "INSERT INTO ids (location_pk, value, type, priority) VALUES (%s, %s, 'KOD_COBCE', 85);", 
-                        (co_pk, kod_co)
-                    )
-                    vlozeno += 1
-                    
+            copy_do_stagingu(cursor, 'stg_casti_obci', ['kod', 'nazev', 'kod_lau2'], (
+                (row[4], row[5], row[8]) for row in reader
+            ))
+
+        vlozeno = vlozit_uzly(cursor, """
+            SELECT s.poradi, gl.pk_id AS parent_id, s.nazev, s.kod
+            FROM stg_casti_obci s
+            JOIN ids i ON i.type = 'LAU2' AND i.value = s.kod_lau2
+            JOIN geo_locations gl ON gl.pk_id = i.location_pk AND gl.typ = 'OBEC'
+        """, 'CAST_OBCE', 'KOD_COBCE', 85)
         print(f"Části obcí úspěšně nahrány. Zavěšeno {vlozeno} uzlů do stromu.")
     except FileNotFoundError:
         print("Chyba: Soubor s vazbami částí obcí nenalezen.")
@@ -336,8 +491,8 @@ def nahrat_casti_obci(cursor):
 def nahrat_psc(cursor):
     """Nahraje PSČ ze souboru a naváže je na MČ, Části obcí a na obec"""
     print("Kontroluji PSČ...")
-    cursor.execute("SELECT count(*) FROM ids WHERE type='PSC';")
-    if cursor.fetchone()[0] > 0:
+    hash_zdroje = hash_souboru('tabulky/zv_cobce_psc-2.csv')
+    if not zdroj_zmenen(cursor, 'PSC', hash_zdroje):
         return
 
     # MOMC kódy (Městské části)
@@ -352,10 +507,10 @@ def nahrat_psc(cursor):
     cursor.execute("SELECT value, location_pk FROM ids WHERE type = 'LAU2';")
     mapa_obce = {row[0].lstrip('0'): row[1] for row in cursor.fetchall()}
 
-    vlozene_vazby_psc = set()
     statistika = {"momc": 0, "cobce": 0, "obce": 0, "nenalezeno": 0}
     unikatni_psc = set()
     nenalezene_zaznamy = []
+    radky = []
 
     try:
         with open('tabulky/zv_cobce_psc-2.csv', 'r', encoding='windows-1250') as f:
@@ -377,38 +532,35 @@ def nahrat_psc(cursor):
                 
                 # 1. navážeme na městskou část
                 if kod_momc and kod_momc in mapa_momc:
-                    target_pk_momc = mapa_momc[kod_momc]
-                    klic_vazby_momc = (target_pk_momc, psc)
-                    if klic_vazby_momc not in vlozene_vazby_psc:
-                        cursor.execute("INSERT INTO ids (location_pk, value, type, priority) VALUES (%s, %s, 'PSC', 60);", (target_pk_momc, psc))
-                        vlozene_vazby_psc.add(klic_vazby_momc)
-                        statistika["momc"] += 1
+                    radky.append((mapa_momc[kod_momc], psc, 'PSC', 60))
                     naslo_se_neco = True
                         
                 # 2. navážeme na část obce
                 if kod_cobce and kod_cobce in mapa_cobce:
-                    target_pk_cobce = mapa_cobce[kod_cobce]
-                    klic_vazby_cobce = (target_pk_cobce, psc)
-                    if klic_vazby_cobce not in vlozene_vazby_psc:
-                        cursor.execute("INSERT INTO ids (location_pk, value, type, priority) VALUES (%s, %s, 'PSC', 60);", (target_pk_cobce, psc))
-                        vlozene_vazby_psc.add(klic_vazby_cobce)
-                        statistika["cobce"] += 1
+                    radky.append((mapa_cobce[kod_cobce], psc, 'PSC', 60))
                     naslo_se_neco = True
 
                 # 3. navážeme na obec
-                    target_pk_obce = mapa_obce[kod_obce]
-                    klic_vazby_obce = (target_pk_obce, psc)
-                    if klic_vazby_obce not in vlozene_vazby_psc:
-                        # Priorita 50 (aby byly části obcí ve výsledcích výš)
-                        cursor.execute("INSERT INTO ids (location_pk, value, type, priority) VALUES (%s, %s, 'PSC', 50);", (target_pk_obce, psc))
-                        vlozene_vazby_psc.add(klic_vazby_obce)
-                        statistika["obce"] += 1
+                    # Priorita 50 (aby byly části obcí ve výsledcích výš)
+                    radky.append((mapa_obce[kod_obce], psc, 'PSC', 50))
                     naslo_se_neco = True
                 
                 # Záznam do logu
                 if not naslo_se_neco:
                     statistika["nenalezeno"] += 1
                     nenalezene_zaznamy.append(f"PSČ: {psc} | Obec RÚIAN: {kod_obce} | Název z pošty: {nazev_cobce}")
+
+        synchronizovat_ids(cursor, 'PSC', hash_zdroje, ['PSC'], radky)
+
+        # počty unikátních vazeb podle typu uzlu (duplicitní vazby ze souboru zahodí synchronizace)
+        cursor.execute("""
+            SELECT gl.typ, count(*) FROM ids i JOIN geo_locations gl ON i.location_pk = gl.pk_id
+            WHERE i.type = 'PSC' GROUP BY gl.typ;
+        """)
+        pocty = dict(cursor.fetchall())
+        statistika["momc"] = pocty.get('MESTSKA_CAST', 0)
+        statistika["cobce"] = pocty.get('CAST_OBCE', 0)
+        statistika["obce"] = pocty.get('OBEC', 0)
                     
         # zapis nepodarenych vazeb do souboru
         if nenalezene_zaznamy:
@@ -436,8 +588,8 @@ def nahrat_psc(cursor):
 def nahrat_mesta_obce_cz(cursor):
     """Nahraje interní ID z portálu mesta.obce.cz a naváže je na uzly pomocí ZUJ (LAU2/MOMC)"""
     print("Kontroluji data z mesta.obce.cz...")
-    cursor.execute("SELECT count(*) FROM ids WHERE type='MESTA_OBCE';")
-    if cursor.fetchone()[0] > 0:
+    hash_zdroje = hash_souboru('tabulky/mesta_obce_id.csv')
+    if not zdroj_zmenen(cursor, 'MESTA_OBCE', hash_zdroje):
         return
 
     # Obce (LAU2)
@@ -449,6 +601,7 @@ def nahrat_mesta_obce_cz(cursor):
     mapa_mc = {row[0].lstrip('0'): row[1] for row in cursor.fetchall()}
 
     vlozeno = 0
+    radky = []
     try:
         with open('tabulky/mesta_obce_id.csv', 'r', encoding='utf-8') as f:
             reader = csv.DictReader(f, delimiter=';')
@@ -468,8 +621,10 @@ def nahrat_mesta_obce_cz(cursor):
                     
                 if target_pk:
                     # Priorita 40 (nižší než státní registry)
-                    cursor.execute("INSERT INTO ids (location_pk, value, type, priority) VALUES (%s, %s, 'MESTA_OBCE', 40);", (target_pk, id_webu))
+                    radky.append((target_pk, id_webu, 'MESTA_OBCE', 40))
                     vlozeno += 1
+
+        synchronizovat_ids(cursor, 'MESTA_OBCE', hash_zdroje, ['MESTA_OBCE'], radky)
                     
         print(f"\n--- REPORT: Mesta.obce.cz ---")
         print(f"Úspěšně spárováno a zavěšeno IDs: {vlozeno}")
@@ -478,32 +633,980 @@ def nahrat_mesta_obce_cz(cursor):
     except FileNotFoundError:
         print("Chyba: Soubor tabulky/mesta_obce_id.csv nenalezen.")
 
-def get_db_connection():
-    return psycopg2.connect(
-        host=os.getenv("DB_HOST"),
-        database=os.getenv("DB_NAME"),
-        user=os.getenv("DB_USER"),
-        password=os.getenv("DB_PASS")
+# --- SNAPSHOT (ZKOMPILOVANÝ STROM + IDENTIFIKÁTORY) ---
+# Formát: MAGIC | verze (u16) | délka hlavičky (u32) | hlavička JSON | sekce.
+# Sekce = zlib(COPY ... TO STDOUT v textovém formátu) pro každou tabulku, v pořadí z hlavičky.
+SNAPSHOT_SOUBOR = os.getenv("SNAPSHOT_SOUBOR", "tabulky/obce.snapshot")
+SNAPSHOT_MAGIC = b"OBECSNAP"
+SNAPSHOT_VERZE = 2
+SNAPSHOT_TABULKY = {
+    'geo_locations': ('pk_id', 'parent_id', 'typ', 'nazev', 'ltree_path'),
+    'ids': ('location_pk', 'value', 'type', 'priority', 'zdroj'),
+    'zdroje_stav': ('zdroj', 'hash', 'aktualizovano'),
+}
+# escape sekvence textového formátu COPY; \ooo a \xhh jsou bajty, proto se dekóduje až po nahrazení
+_COPY_ESCAPE = re.compile(rb'\\(?:([0-7]{1,3})|x([0-9a-fA-F]{1,2})|(.))', re.DOTALL)
+_COPY_ZNAKY = {b'b': b'\b', b'f': b'\f', b'n': b'\n', b'r': b'\r', b't': b'\t', b'v': b'\v'}
+
+
+def _copy_unescape(m):
+    if m.group(1):
+        return bytes([int(m.group(1), 8) & 0xFF])
+    if m.group(2):
+        return bytes([int(m.group(2), 16)])
+    return _COPY_ZNAKY.get(m.group(3), m.group(3))
+
+
+class Snapshot:
+    def __init__(self, hlavicka, sekce, hash_souboru):
+        self.hlavicka = hlavicka
+        self.hash = hash_souboru
+        self._sekce = sekce   # tabulka -> zkomprimovaná data
+
+    def copy_text(self, tabulka):
+        return zlib.decompress(self._sekce[tabulka]).decode('utf-8')
+
+    def radky(self, tabulka):
+        """Řádky tabulky jako n-tice řetězců (NULL -> None)."""
+        # dělí se jen podle \n a \t (splitlines by dělil i podle U+2028, \x0c apod., které COPY neescapuje)
+        for radek in zlib.decompress(self._sekce[tabulka]).split(b'\n'):
+            if not radek:
+                continue
+            yield tuple(
+                None if pole == b'\\N' else (_COPY_ESCAPE.sub(_copy_unescape, pole) if b'\\' in pole else pole).decode('utf-8')
+                for pole in radek.split(b'\t')
+            )
+
+    def uzly(self):
+        """(pk_id, nazev, typ, ltree_path) - stejný tvar jako IdIndex.SQL_UZLY."""
+        return [(int(pk_id), nazev, typ, cesta) for pk_id, _, typ, nazev, cesta in self.radky('geo_locations')]
+
+    def ids(self):
+        """(value, type, priority, location_pk) - stejný tvar jako IdIndex.SQL_IDS."""
+        return [(value, typ, int(priorita) if priorita else 0, int(pk)) for pk, value, typ, priorita, _ in self.radky('ids')]
+
+
+def vytvorit_snapshot(cursor, cesta=SNAPSHOT_SOUBOR):
+    """Zapíše aktuální obsah db do snapshotu (atomicky přes dočasný soubor)."""
+    hlavicka = {
+        "verze": SNAPSHOT_VERZE,
+        "vytvoreno": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        # z jakých CSV snapshot vznikl (jen informativně, startup je znovu nehashuje)
+        "zdroje": {os.path.basename(f): hash_souboru(f) for f in sorted(glob.glob('tabulky/*.csv'))},
+        "sekce": [],
+    }
+    sekce = []
+    for tabulka, sloupce in SNAPSHOT_TABULKY.items():
+        podminka = " WHERE zdroj <> 'SNAPSHOT'" if tabulka == 'zdroje_stav' else ""
+        buffer = io.StringIO()
+        cursor.copy_expert(
+            f"COPY (SELECT {', '.join(sloupce)} FROM {tabulka}{podminka} ORDER BY 1) TO STDOUT", buffer
+        )
+        data = zlib.compress(buffer.getvalue().encode('utf-8'), 6)
+        hlavicka["sekce"].append({"tabulka": tabulka, "delka": len(data), "radku": buffer.getvalue().count('\n')})
+        sekce.append(data)
+
+    hlavicka_json = json.dumps(hlavicka, ensure_ascii=False).encode('utf-8')
+    docasny = cesta + '.tmp'
+    with open(docasny, 'wb') as f:
+        f.write(SNAPSHOT_MAGIC + struct.pack('>HI', SNAPSHOT_VERZE, len(hlavicka_json)) + hlavicka_json)
+        for data in sekce:
+            f.write(data)
+    os.replace(docasny, cesta)
+    return hlavicka
+
+
+def nacist_snapshot(cesta=SNAPSHOT_SOUBOR):
+    """Načte snapshot; None, pokud neexistuje nebo má jinou verzi formátu."""
+    try:
+        with open(cesta, 'rb') as f:
+            obsah = f.read()
+    except FileNotFoundError:
+        return None
+
+    if obsah[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+        print(f"Soubor {cesta} není snapshot, ignoruji ho.")
+        return None
+    pozice = len(SNAPSHOT_MAGIC)
+    verze, delka_hlavicky = struct.unpack_from('>HI', obsah, pozice)
+    if verze != SNAPSHOT_VERZE:
+        print(f"Snapshot {cesta} má verzi {verze}, podporovaná je {SNAPSHOT_VERZE}, ignoruji ho.")
+        return None
+    pozice += struct.calcsize('>HI')
+    hlavicka = json.loads(obsah[pozice:pozice + delka_hlavicky])
+    pozice += delka_hlavicky
+
+    sekce = {}
+    for s in hlavicka["sekce"]:
+        sekce[s["tabulka"]] = obsah[pozice:pozice + s["delka"]]
+        pozice += s["delka"]
+    return Snapshot(hlavicka, sekce, hashlib.sha256(obsah).hexdigest())
+
+
+def obnovit_ze_snapshotu(cursor, snapshot):
+    """Nahraje snapshot do prázdné db přes COPY (ltree_path je ve snapshotu, trigger ho nechá být)."""
+    cursor.execute("DELETE FROM zdroje_stav;")
+    for tabulka, sloupce in SNAPSHOT_TABULKY.items():
+        cursor.copy_expert(
+            f"COPY {tabulka} ({', '.join(sloupce)}) FROM STDIN", io.StringIO(snapshot.copy_text(tabulka))
+        )
+    cursor.execute("SELECT setval(pg_get_serial_sequence('geo_locations', 'pk_id'), COALESCE(max(pk_id), 1)) FROM geo_locations;")
+    # značka, ze kterého snapshotu data jsou - další start pak CSV vůbec neotevírá
+    cursor.execute("""
+        INSERT INTO zdroje_stav (zdroj, hash, aktualizovano) VALUES ('SNAPSHOT', %s, now())
+        ON CONFLICT (zdroj) DO UPDATE SET hash = EXCLUDED.hash, aktualizovano = now();
+    """, (snapshot.hash,))
+    cursor.connection.commit()
+
+
+# --- POOL SPOJENÍ ---
+DB_PARAMETRY = {
+    "host": os.getenv("DB_HOST"),
+    "database": os.getenv("DB_NAME"),
+    "user": os.getenv("DB_USER"),
+    "password": os.getenv("DB_PASS"),
+}
+# Rozpočet spojení na jeden proces (uvicorn worker) = DB_POOL_MAX + DB_ASYNC_POOL_MAX;
+# součet přes všechny workery a repliky musí zůstat pod max_connections Postgresu (výchozí 100).
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))     # psycopg2 pool: loader, snapshot, /sync/ids, /location/bulk
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_ASYNC_POOL_MIN = int(os.getenv("DB_ASYNC_POOL_MIN", "2"))    # async pool: všechny ostatní endpointy
+DB_ASYNC_POOL_MAX = int(os.getenv("DB_ASYNC_POOL_MAX", "10"))
+DB_ASYNC_POOL_MAX_IDLE = float(os.getenv("DB_ASYNC_POOL_MAX_IDLE", "600"))  # nečinné spojení nad min se po té době zavře (s)
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))         # max. čekání na volné spojení (s)
+DB_POOL_PING_PO = float(os.getenv("DB_POOL_PING_PO", "30"))        # spojení nečinné déle se před výpůjčkou ověří (s)
+DB_START_TIMEOUT = float(os.getenv("DB_START_TIMEOUT", "20"))      # jak dlouho čekat na start db (s)
+
+
+class DbPool:
+    """Sdílený pool spojení pro celý proces (kontrola zdraví při výpůjčce + metriky)."""
+
+    def __init__(self, minconn, maxconn, timeout, ping_po, **parametry):
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.ping_po = ping_po
+        self._pool = pg_pool.ThreadedConnectionPool(minconn, maxconn, **parametry)
+        self._volna_mista = threading.BoundedSemaphore(maxconn)
+        self._zamek = threading.Lock()
+        self._naposledy_pouzito = {}
+        self._metriky = {
+            "vypujceno": 0,
+            "cekajici": 0,
+            "vypujcek_celkem": 0,
+            "timeoutu": 0,
+            "vadnych_spojeni": 0,
+            "cekani_celkem_ms": 0.0,
+            "cekani_max_ms": 0.0,
+        }
+
+    def _zdrave_spojeni(self, conn):
+        if conn.closed:
+            return False
+        if time.monotonic() - self._naposledy_pouzito.get(id(conn), 0) < self.ping_po:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1;")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _vypujcit(self):
+        conn = self._pool.getconn()
+        while not self._zdrave_spojeni(conn):
+            with self._zamek:
+                self._metriky["vadnych_spojeni"] += 1
+            self._naposledy_pouzito.pop(id(conn), None)
+            self._pool.putconn(conn, close=True)
+            conn = self._pool.getconn()
+        return conn
+
+    @contextmanager
+    def spojeni(self):
+        """Vypůjčí spojení z poolu a po skončení bloku ho vrátí (nedokončenou transakci odvolá)."""
+        zacatek = time.perf_counter()
+        with self._zamek:
+            self._metriky["cekajici"] += 1
+        ziskano = self._volna_mista.acquire(timeout=self.timeout)
+        with self._zamek:
+            self._metriky["cekajici"] -= 1
+            if not ziskano:
+                self._metriky["timeoutu"] += 1
+        if not ziskano:
+            raise HTTPException(status_code=503, detail="Databáze je přetížená, zkuste to později.")
+
+        try:
+            conn = self._vypujcit()
+        except Exception:
+            self._volna_mista.release()
+            raise
+
+        cekani_ms = (time.perf_counter() - zacatek) * 1000
+        with self._zamek:
+            self._metriky["vypujceno"] += 1
+            self._metriky["vypujcek_celkem"] += 1
+            self._metriky["cekani_celkem_ms"] += cekani_ms
+            self._metriky["cekani_max_ms"] = max(self._metriky["cekani_max_ms"], cekani_ms)
+
+        try:
+            yield conn
+        finally:
+            zavrit = bool(conn.closed)
+            if not zavrit:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    zavrit = True
+            if zavrit:
+                self._naposledy_pouzito.pop(id(conn), None)
+            else:
+                self._naposledy_pouzito[id(conn)] = time.monotonic()
+            self._pool.putconn(conn, close=zavrit)
+            with self._zamek:
+                self._metriky["vypujceno"] -= 1
+            self._volna_mista.release()
+
+    def metriky(self):
+        with self._zamek:
+            m = dict(self._metriky)
+        m["max_spojeni"] = self.maxconn
+        m["cekani_prumer_ms"] = round(m["cekani_celkem_ms"] / m["vypujcek_celkem"], 3) if m["vypujcek_celkem"] else 0.0
+        m["cekani_celkem_ms"] = round(m["cekani_celkem_ms"], 3)
+        m["cekani_max_ms"] = round(m["cekani_max_ms"], 3)
+        return m
+
+    def zavrit(self):
+        self._pool.closeall()
+
+
+db_pool = None
+
+def inicializovat_pool():
+    """Vytvoří pool; dokud db startuje, zkouší to znovu (nejdéle DB_START_TIMEOUT sekund)."""
+    global db_pool
+    if db_pool is not None:
+        return db_pool
+
+    konec = time.monotonic() + DB_START_TIMEOUT
+    pauza = 0.1
+    while True:
+        try:
+            db_pool = DbPool(DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT, DB_POOL_PING_PO, **DB_PARAMETRY)
+            return db_pool
+        except psycopg2.OperationalError:
+            if time.monotonic() >= konec:
+                raise
+            time.sleep(pauza)
+            pauza = min(pauza * 2, 2)
+
+def db_spojeni():
+    return inicializovat_pool().spojeni()
+
+
+# --- ASYNC POOL PRO REQUESTY ---
+# Startovní loader (COPY, staging) jede přes psycopg2 pool výše, endpointy přes asyncio
+# pool psycopg 3 - čekání na db pak nedrží vlákno, jen korutinu.
+async_pool = None
+
+async def otevrit_async_pool():
+    global async_pool
+    async_pool = AsyncConnectionPool(
+        kwargs={
+            "host": DB_PARAMETRY["host"],
+            "dbname": DB_PARAMETRY["database"],
+            "user": DB_PARAMETRY["user"],
+            "password": DB_PARAMETRY["password"],
+        },
+        min_size=DB_ASYNC_POOL_MIN,
+        max_size=DB_ASYNC_POOL_MAX,
+        timeout=DB_POOL_TIMEOUT,
+        max_idle=DB_ASYNC_POOL_MAX_IDLE,
+        check=AsyncConnectionPool.check_connection,
+        open=False,
     )
+    await async_pool.open(wait=True, timeout=DB_START_TIMEOUT)
+
+@asynccontextmanager
+async def async_db_spojeni():
+    """Vypůjčí spojení z async poolu; když žádné není volné do DB_POOL_TIMEOUT, vrátí 503."""
+    if async_pool is None:
+        raise HTTPException(status_code=503, detail="Databáze není dostupná.")
+    try:
+        async with async_pool.connection() as conn:
+            yield conn
+    except PoolTimeout:
+        raise HTTPException(status_code=503, detail="Databáze je přetížená, zkuste to později.")
+
+
+# --- CACHE HORNÍ ČÁSTI STROMU ---
+class StromCache:
+    """Uzly KRAJ/OKRES/OBEC v paměti procesu (klíč pk_id), aby cesta předků nemusela do db."""
+
+    TYPY = ('KRAJ', 'OKRES', 'OBEC')
+    SQL_NAPLNENI = "SELECT pk_id, nazev, typ, ltree_path::text FROM geo_locations WHERE typ IN ('KRAJ', 'OKRES', 'OBEC');"
+
+    def __init__(self):
+        self._uzly = None   # pk_id -> (popisek "Název (TYP)", ltree_path)
+        self._zamek = threading.Lock()
+        self.zasahy = 0
+        self.minuti = 0
+
+    @property
+    def naplnena(self):
+        return self._uzly is not None
+
+    def naplnit(self, cursor):
+        cursor.execute(self.SQL_NAPLNENI)
+        self.nastavit(cursor.fetchall())
+
+    async def naplnit_async(self, cursor):
+        await cursor.execute(self.SQL_NAPLNENI)
+        self.nastavit(await cursor.fetchall())
+
+    def nastavit(self, radky):
+        uzly = {pk_id: (f"{nazev} ({typ})", cesta) for pk_id, nazev, typ, cesta in radky}
+        with self._zamek:
+            self._uzly = uzly
+
+    def pridat(self, pk_id, nazev, typ, ltree_cesta):
+        """Po create_location: nový uzel horní úrovně rovnou přidá."""
+        with self._zamek:
+            if self._uzly is not None and typ in self.TYPY:
+                self._uzly[pk_id] = (f"{nazev} ({typ})", ltree_cesta)
+
+    def odebrat(self, pk_ids):
+        """Po delete_location: zahodí smazané uzly (pk_id vrácená z DELETE ... RETURNING)."""
+        with self._zamek:
+            if self._uzly is not None:
+                for pk_id in pk_ids:
+                    self._uzly.pop(pk_id, None)
+
+    def presunout(self, nove_cesty):
+        """Po přesunu podstromu: přepíše cesty přesunutých uzlů, které v cache jsou."""
+        with self._zamek:
+            if self._uzly is not None:
+                for pk_id, cesta in nove_cesty:
+                    uzel = self._uzly.get(pk_id)
+                    if uzel is not None:
+                        self._uzly[pk_id] = (uzel[0], cesta)
+
+    def cesty(self, ltree_cesty):
+        """Vrátí ({cesta: text}, [cesty, které v cache nejsou celé])."""
+        uzly = self._uzly or {}
+        vysledek = {}
+        chybejici = []
+        for cesta in ltree_cesty:
+            rodice_seznam = []
+            for pk in cesta.split('.')[:-1]:
+                uzel = uzly.get(int(pk))
+                if uzel is None:
+                    break
+                rodice_seznam.append(uzel[0])
+            else:
+                vysledek[cesta] = " > ".join(rodice_seznam) if rodice_seznam else "Kořenový uzel"
+                continue
+            chybejici.append(cesta)
+
+        with self._zamek:
+            self.zasahy += len(vysledek)
+            self.minuti += len(chybejici)
+        return vysledek, chybejici
+
+    def metriky(self):
+        return {
+            "uzlu": len(self._uzly) if self._uzly is not None else 0,
+            "zasahy": self.zasahy,
+            "minuti": self.minuti,
+        }
+
+
+strom_cache = StromCache()
+
+
+# --- IN-MEMORY INDEX IDENTIFIKÁTORŮ (REŽIM JEN PRO ČTENÍ) ---
+REZIM_CTENI = os.getenv("READ_ONLY", "0").lower() in ("1", "true", "ano")
+INDEX_OBNOVA_S = float(os.getenv("INDEX_OBNOVA_S", "0"))   # periodická obnova indexu (s), 0 = jen na SIGHUP
+
+
+class IdIndex:
+    """
+    Celé ids + geo_locations v paměti procesu pro repliky, které nezapisují.
+    Uzly jsou v polích (index uzlu -> název, typ, hotová cesta předků), identifikátory
+    v paralelních polích (index -> uzel, priorita, typ kódu) a hodnota ukazuje na
+    n-tici indexů identifikátorů seřazenou podle priority.
+    Obnova postaví nová data vedle a pak je jedním přiřazením vymění.
+    """
+
+    SQL_UZLY = "SELECT pk_id, nazev, typ, ltree_path::text FROM geo_locations;"
+    SQL_IDS = "SELECT value, type, priority, location_pk FROM ids;"
+
+    def __init__(self):
+        self._data = None   # (hodnoty, nazvy, typy_uzlu, cesty, id_uzly, id_priority, id_typy)
+        self.nacteno = None
+        self.obnov = 0
+
+    @property
+    def naplnen(self):
+        return self._data is not None
+
+    def naplnit(self, cursor):
+        cursor.execute(self.SQL_UZLY)
+        uzly = cursor.fetchall()
+        cursor.execute(self.SQL_IDS)
+        self.nastavit(uzly, cursor.fetchall())
+
+    def nastavit(self, uzly, ids):
+        nazvy, typy_uzlu, cesty = [], [], []
+        index_uzlu = {}
+        popisky = {}
+        for pk_id, nazev, typ, cesta in uzly:
+            index_uzlu[pk_id] = len(nazvy)
+            nazvy.append(nazev)
+            typy_uzlu.append(sys.intern(typ))
+            cesty.append(cesta)
+            popisky[str(pk_id)] = f"{nazev} ({typ})"
+
+        # cesta předků je pro každý uzel hotový text, hledání už nic neskládá
+        for i, cesta in enumerate(cesty):
+            rodice_seznam = [popisky[pk] for pk in (cesta or '').split('.')[:-1] if pk in popisky]
+            cesty[i] = " > ".join(rodice_seznam) if rodice_seznam else "Kořenový uzel"
+
+        # typ kódu je volný text (POST /location), proto se nebalí do bitů, ale drží jako
+        # internovaný řetězec - stejné typy sdílí jeden objekt
+        id_uzly, id_priority, id_typy = array('l'), array('q'), []
+        hodnoty = {}
+        for value, typ_kodu, priorita, location_pk in ids:
+            uzel = index_uzlu.get(location_pk)
+            if uzel is None:
+                continue
+            hodnoty.setdefault(value, []).append(len(id_typy))
+            id_uzly.append(uzel)
+            id_priority.append(priorita or 0)
+            id_typy.append(sys.intern(typ_kodu))
+
+        for value, polozky in hodnoty.items():
+            polozky.sort(key=lambda i: -id_priority[i])
+            hodnoty[value] = tuple(polozky)
+
+        self._data = (hodnoty, nazvy, typy_uzlu, cesty, id_uzly, id_priority, id_typy)
+        self.nacteno = time.time()
+        self.obnov += 1
+
+    def hledat(self, hledane_hodnoty, db_type_filter=None):
+        """Přesná shoda ve formátu výsledků search_id, seřazená podle priority."""
+        hodnoty, nazvy, typy_uzlu, cesty, id_uzly, id_priority, id_typy = self._data
+        nalezeno = []
+        for hodnota in hledane_hodnoty:
+            for i in hodnoty.get(hodnota, ()):
+                if db_type_filter is None or id_typy[i] == db_type_filter:
+                    nalezeno.append((i, hodnota))
+        if len(hledane_hodnoty) > 1:
+            nalezeno.sort(key=lambda n: -id_priority[n[0]])
+
+        return [{
+            "obec": nazvy[id_uzly[i]],
+            "kod": hodnota,
+            "typ": id_typy[i],
+            "typ_uzlu": typy_uzlu[id_uzly[i]],
+            "shoda": "100 %",
+            "cesta": cesty[id_uzly[i]]
+        } for i, hodnota in nalezeno]
+
+    def metriky(self):
+        if self._data is None:
+            return {"naplnen": False, "rezim_cteni": REZIM_CTENI}
+        hodnoty, nazvy = self._data[0], self._data[1]
+        return {
+            "naplnen": True,
+            "rezim_cteni": REZIM_CTENI,
+            "hodnot": len(hodnoty),
+            "uzlu": len(nazvy),
+            "nacteno": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.nacteno)),
+            "obnov": self.obnov,
+        }
+
+
+id_index = IdIndex()
+_obnova_indexu = threading.Lock()
+
+
+def naplnit_index():
+    """Načte index ze snapshotu, a pokud není, z db. Vrací zdroj dat."""
+    snapshot = nacist_snapshot()
+    if snapshot is not None:
+        uzly, ids = snapshot.uzly(), snapshot.ids()
+        id_index.nastavit(uzly, ids)
+        naseptavac.nastavit(uzly, ids)
+        return f"snapshot {snapshot.hlavicka['vytvoreno']}"
+    with db_spojeni() as conn:
+        cursor = conn.cursor()
+        id_index.naplnit(cursor)
+        naplnit_naseptavac(cursor)
+        cursor.close()
+    return "db"
+
+
+async def obnovit_index():
+    """Znovu načte index v samostatném vlákně, requesty mezitím běží nad starými daty."""
+    if not _obnova_indexu.acquire(blocking=False):
+        return
+    try:
+        zacatek = time.perf_counter()
+        zdroj = await asyncio.to_thread(naplnit_index)
+        odpovedi_cache.vymazat()
+        print(f"Index identifikátorů obnoven ({zdroj}) za {time.perf_counter() - zacatek:.2f} s.")
+    except Exception as e:
+        print(f"Obnova indexu identifikátorů selhala: {e}")
+    finally:
+        _obnova_indexu.release()
+
+
+async def obnovovat_index_periodicky():
+    while True:
+        await asyncio.sleep(INDEX_OBNOVA_S)
+        await obnovit_index()
+
+
+def zkontrolovat_zapis():
+    if REZIM_CTENI:
+        raise HTTPException(status_code=403, detail="Instance běží v režimu jen pro čtení, zápis není povolen.")
+
+
+# --- CACHE ODPOVĚDÍ VYHLEDÁVÁNÍ ---
+CACHE_VELIKOST = int(os.getenv("CACHE_VELIKOST", "10000"))   # max. počet odpovědí, 0 = cache vypnutá
+CACHE_TTL_S = float(os.getenv("CACHE_TTL_S", "300"))
+
+
+class OdpovediCache:
+    """
+    LRU + TTL cache hotových odpovědí search_id, klíč (normalizovaný dotaz, filtr typu).
+    U každé odpovědi si pamatuje hledané hodnoty a ltree cesty výsledků, aby šla
+    po zápisu zahodit jen dotčená část. 404 se necachuje.
+    """
+
+    def __init__(self, velikost, ttl):
+        self.velikost = velikost
+        self.ttl = ttl
+        self._polozky = OrderedDict()   # klic -> (expirace, odpoved, hledane_hodnoty, ltree_cesty, fuzzy)
+        self._zamek = threading.Lock()
+        self.verze = 0                  # zvyšuje se při každém zneplatnění
+        self.zasahy = 0
+        self.minuti = 0
+        self.vyprselo = 0
+        self.zneplatneno = 0
+
+    def ziskat(self, klic):
+        with self._zamek:
+            polozka = self._polozky.get(klic)
+            if polozka is not None and polozka[0] < time.monotonic():
+                del self._polozky[klic]
+                self.vyprselo += 1
+                polozka = None
+            if polozka is None:
+                self.minuti += 1
+                return None
+            self._polozky.move_to_end(klic)
+            self.zasahy += 1
+            return polozka[1]
+
+    def ulozit(self, klic, odpoved, hledane_hodnoty, ltree_cesty, verze):
+        """verze = self.verze z doby před dotazem do db; když mezitím proběhl zápis, odpověď se neuloží."""
+        if self.velikost <= 0:
+            return
+        with self._zamek:
+            if verze != self.verze:
+                return
+            self._polozky[klic] = (
+                time.monotonic() + self.ttl, odpoved, frozenset(hledane_hodnoty),
+                tuple(c for c in ltree_cesty if c), odpoved["status"] == "fuzzy_match"
+            )
+            self._polozky.move_to_end(klic)
+            while len(self._polozky) > self.velikost:
+                self._polozky.popitem(last=False)
+
+    def _zahodit(self, podminka):
+        with self._zamek:
+            self.verze += 1
+            klice = [klic for klic, polozka in self._polozky.items() if podminka(polozka)]
+            for klic in klice:
+                del self._polozky[klic]
+            self.zneplatneno += len(klice)
+
+    def zneplatnit_hodnoty(self, hodnoty):
+        """Po create_location: přesné shody na nové hodnoty a všechny fuzzy odpovědi (nová hodnota může být blíž)."""
+        hodnoty = set(hodnoty)
+        self._zahodit(lambda p: p[4] or not p[2].isdisjoint(hodnoty))
+
+    def zneplatnit_podstrom(self, ltree_cesta):
+        """Po delete_location: odpovědi, ve kterých je smazaný uzel nebo jeho potomek."""
+        predpona = ltree_cesta + '.'
+        self._zahodit(lambda p: any(c == ltree_cesta or c.startswith(predpona) for c in p[3]))
+
+    def vymazat(self):
+        self._zahodit(lambda p: True)
+
+    def metriky(self):
+        dotazu = self.zasahy + self.minuti
+        return {
+            "polozek": len(self._polozky),
+            "velikost": self.velikost,
+            "ttl_s": self.ttl,
+            "zasahy": self.zasahy,
+            "minuti": self.minuti,
+            "uspesnost": round(self.zasahy / dotazu, 4) if dotazu else None,
+            "vyprselo": self.vyprselo,
+            "zneplatneno": self.zneplatneno,
+        }
+
+
+odpovedi_cache = OdpovediCache(CACHE_VELIKOST, CACHE_TTL_S)
+
+
+# --- NAŠEPTÁVAČ (PREFIXOVÉ HLEDÁNÍ V PAMĚTI) ---
+# názvy uzlů nemají vlastní prioritu, řadí se podle typu uzlu
+PRIORITA_NAZVU = {'KRAJ': 100, 'OKRES': 95, 'OBEC': 90, 'MESTSKA_CAST': 70, 'CAST_OBCE': 60}
+NASEPTAVAC_K_MAX = 50              # nejvyšší k, které /suggest dovolí
+NASEPTAVAC_PREDPOCITAT_DELKA = 2   # pro takhle krátké prefixy je top-k spočítané předem (rozsah v poli je velký)
+NASEPTAVAC_INSORT_MAX = 64         # do kolika nových položek se vkládá přes insort, víc se slije řazením
+
+
+def normalizovat_text(text):
+    """Malá písmena bez diakritiky, mezery sjednocené - stejně jako norm_nazev() v db."""
+    text = unicodedata.normalize('NFKD', text)
+    return " ".join("".join(z for z in text if not unicodedata.combining(z)).lower().split())
+
+
+def _poradi_shody(p):
+    # stejná priorita -> kratší (přesnější) shoda dřív
+    return (p[1], len(p[0]), p[0])
+
+
+class Naseptavac:
+    """
+    Seřazená pole (klíč, -priorita, ...) pro kódy (ids.value bez mezer, malými písmeny)
+    a normalizované názvy uzlů. Prefix se najde přes bisect, z rozsahu se vezme top-k
+    podle priority; pro prefixy do NASEPTAVAC_PREDPOCITAT_DELKA znaků je top-k
+    spočítané předem, jinak by se procházely desetitisíce položek.
+    Zápisy (create/delete/move) jsou přírůstkové: kopie pole (memcpy) + insort / del
+    podle klíče, do předpočítaných top-k se sáhne jen u dotčených prefixů.
+    Stav je jedna n-tice, která se při změně celá nahradí novou - hledání si ji
+    přečte jednou, takže nikdy nesmíchá stará a nová pole.
+    """
+
+    def __init__(self):
+        # (kody, nazvy, uzly, top_kody, top_nazvy):
+        #   kody  = [(klic, -priorita, hodnota, typ kódu, pk_id)]
+        #   nazvy = [(klic, -priorita, nazev, typ uzlu, pk_id)]
+        #   uzly  = {pk_id: (nazev, typ, ltree_path)}
+        #   top_* = {krátký prefix: nejlepších NASEPTAVAC_K_MAX položek z pole, seřazené}
+        self._stav = None
+        self._zamek = threading.Lock()   # jen pro zapisující (dva zápisy naráz by jeden ztratily)
+
+    @property
+    def naplnen(self):
+        return self._stav is not None
+
+    @staticmethod
+    def _polozka_nazvu(pk_id, nazev, typ):
+        return (normalizovat_text(nazev), -PRIORITA_NAZVU.get(typ, 0), nazev, typ, pk_id)
+
+    @staticmethod
+    def _polozka_kodu(pk_id, value, typ_kodu, priorita):
+        return (value.replace(" ", "").lower(), -(priorita or 0), value, typ_kodu, pk_id)
+
+    @staticmethod
+    def _rozsah(pole, prefix):
+        return bisect.bisect_left(pole, (prefix,)), bisect.bisect_left(pole, (prefix + '\uffff',))
+
+    @classmethod
+    def _top_z_pole(cls, pole, prefix, k):
+        zacatek, konec = cls._rozsah(pole, prefix)
+        return heapq.nsmallest(k, (pole[i] for i in range(zacatek, konec)), key=_poradi_shody)
+
+    @staticmethod
+    def _predpocitat(pole):
+        kose = {}
+        for p in pole:
+            for delka in range(1, min(len(p[0]), NASEPTAVAC_PREDPOCITAT_DELKA) + 1):
+                kose.setdefault(p[0][:delka], []).append(p)
+        return {prefix: heapq.nsmallest(NASEPTAVAC_K_MAX, kos, key=_poradi_shody) for prefix, kos in kose.items()}
+
+    @staticmethod
+    def _vlozit(pole, top, nove):
+        """Vrátí kopie (pole, top) s vloženými položkami."""
+        pole = list(pole)
+        if len(nove) <= NASEPTAVAC_INSORT_MAX:
+            for p in nove:
+                bisect.insort(pole, p)
+        else:
+            pole += nove
+            pole.sort()   # dva seřazené běhy - timsort je jen slije
+        top = dict(top)
+        for p in nove:
+            for delka in range(1, min(len(p[0]), NASEPTAVAC_PREDPOCITAT_DELKA) + 1):
+                prefix = p[0][:delka]
+                top[prefix] = heapq.nsmallest(NASEPTAVAC_K_MAX, top.get(prefix, []) + [p], key=_poradi_shody)
+        return pole, top
+
+    @classmethod
+    def _smazat(cls, pole, top, klice):
+        """
+        Vrátí kopie (pole, top) bez položek daných (klic, text, pk_id). Položka se hledá
+        přes bisect mezi stejnými klíči, priorita k nalezení potřeba není.
+        """
+        pole = list(pole)
+        smazane = set()
+        for klic, text, pk_id in klice:
+            i = bisect.bisect_left(pole, (klic,))
+            while i < len(pole) and pole[i][0] == klic:
+                if pole[i][2] == text and pole[i][4] == pk_id:
+                    smazane.add(pole[i])
+                    del pole[i]
+                else:
+                    i += 1
+        if not smazane:
+            return pole, top
+        top = dict(top)
+        for klic in {p[0] for p in smazane}:
+            for delka in range(1, min(len(klic), NASEPTAVAC_PREDPOCITAT_DELKA) + 1):
+                prefix = klic[:delka]
+                kos = top.get(prefix)
+                if kos is None:
+                    continue
+                zbytek = [p for p in kos if p not in smazane]
+                if len(zbytek) == len(kos):
+                    continue
+                if len(kos) == NASEPTAVAC_K_MAX:
+                    # plný koš mohl mít za hranou další kandidáty - spočítat z pole znovu
+                    zbytek = cls._top_z_pole(pole, prefix, NASEPTAVAC_K_MAX)
+                if zbytek:
+                    top[prefix] = zbytek
+                else:
+                    del top[prefix]
+        return pole, top
+
+    def nastavit(self, uzly, ids):
+        """uzly = (pk_id, nazev, typ, ltree_path), ids = (value, type, priority, location_pk)."""
+        mapa_uzlu = {pk_id: (nazev, typ, cesta) for pk_id, nazev, typ, cesta in uzly}
+        nazvy = sorted(self._polozka_nazvu(pk_id, nazev, typ) for pk_id, nazev, typ, cesta in uzly)
+        kody = sorted(
+            self._polozka_kodu(pk, value, typ_kodu, priorita)
+            for value, typ_kodu, priorita, pk in ids if pk in mapa_uzlu
+        )
+        stav = (kody, nazvy, mapa_uzlu, self._predpocitat(kody), self._predpocitat(nazvy))
+        with self._zamek:
+            self._stav = stav
+
+    def pridat(self, nove_uzly):
+        """
+        Po create_location / importu: nové uzly a jejich kódy se vloží do kopií polí (bez přestavby).
+        nove_uzly = [(pk_id, nazev, typ, ltree_path, [(value, type, priority)])]
+        """
+        nove_nazvy = [self._polozka_nazvu(pk_id, nazev, typ) for pk_id, nazev, typ, _, _ in nove_uzly]
+        nove_kody = [
+            self._polozka_kodu(pk_id, value, typ_kodu, priorita)
+            for pk_id, _, _, _, identifikatory in nove_uzly
+            for value, typ_kodu, priorita in set(identifikatory)
+        ]
+        with self._zamek:
+            if self._stav is None:
+                return
+            kody, nazvy, uzly, top_kody, top_nazvy = self._stav
+            uzly = dict(uzly)
+            for pk_id, nazev, typ, ltree_cesta, _ in nove_uzly:
+                uzly[pk_id] = (nazev, typ, ltree_cesta)
+            kody, top_kody = self._vlozit(kody, top_kody, nove_kody)
+            nazvy, top_nazvy = self._vlozit(nazvy, top_nazvy, nove_nazvy)
+            self._stav = (kody, nazvy, uzly, top_kody, top_nazvy)
+
+    def odebrat(self, smazane_uzly, smazane_kody):
+        """
+        Po delete_location: pryč smazané uzly a jejich kódy, tak jak je vrátil DELETE ... RETURNING.
+        smazane_uzly = [pk_id], smazane_kody = [(location_pk, value)]
+        """
+        with self._zamek:
+            if self._stav is None:
+                return
+            kody, nazvy, uzly, top_kody, top_nazvy = self._stav
+            uzly = dict(uzly)
+            klice_nazvu = []
+            for pk_id in smazane_uzly:
+                uzel = uzly.pop(pk_id, None)
+                if uzel is not None:
+                    klice_nazvu.append((normalizovat_text(uzel[0]), uzel[0], pk_id))
+            kody, top_kody = self._smazat(
+                kody, top_kody, [(value.replace(" ", "").lower(), value, pk) for pk, value in smazane_kody]
+            )
+            nazvy, top_nazvy = self._smazat(nazvy, top_nazvy, klice_nazvu)
+            self._stav = (kody, nazvy, uzly, top_kody, top_nazvy)
+
+    def presunout(self, nove_cesty):
+        """Po přesunu podstromu: přepíše cesty přesunutých uzlů (nadřazený uzel se bere z cesty).
+        nove_cesty = [(pk_id, ltree_path)] z UPDATE ... RETURNING."""
+        with self._zamek:
+            if self._stav is None:
+                return
+            kody, nazvy, uzly, top_kody, top_nazvy = self._stav
+            uzly = dict(uzly)
+            for pk_id, cesta in nove_cesty:
+                uzel = uzly.get(pk_id)
+                if uzel is not None:
+                    uzly[pk_id] = (uzel[0], uzel[1], cesta)
+            self._stav = (kody, nazvy, uzly, top_kody, top_nazvy)
+
+    def _top(self, pole, top, prefix, k):
+        if len(prefix) <= NASEPTAVAC_PREDPOCITAT_DELKA:
+            return top.get(prefix, [])[:k]
+        return self._top_z_pole(pole, prefix, k)
+
+    def hledat(self, dotaz, k=10, druh=None):
+        kody, nazvy, uzly, top_kody, top_nazvy = self._stav   # jedno čtení = jeden konzistentní stav
+        kandidati = []
+        if druh in (None, 'kod'):
+            prefix = dotaz.replace(" ", "").lower()
+            if prefix:
+                kandidati += [('kod',) + p for p in self._top(kody, top_kody, prefix, k)]
+        if druh in (None, 'nazev'):
+            prefix = normalizovat_text(dotaz)
+            if prefix:
+                kandidati += [('nazev',) + p for p in self._top(nazvy, top_nazvy, prefix, k)]
+        kandidati.sort(key=lambda p: (p[2], len(p[1]), p[1]))
+
+        vysledek = []
+        for druh_shody, _, minus_priorita, text, typ, pk_id in kandidati[:k]:
+            nazev, typ_uzlu, cesta = uzly[pk_id]
+            casti = (cesta or '').split('.')
+            rodic = uzly.get(int(casti[-2])) if len(casti) > 1 else None
+            vysledek.append({
+                "text": text,
+                "druh": druh_shody,
+                "typ": typ,
+                "obec": nazev,
+                "typ_uzlu": typ_uzlu,
+                "nadrazeny": rodic[0] if rodic else None,
+                "priorita": -minus_priorita,
+            })
+        return vysledek
+
+    def metriky(self):
+        if self._stav is None:
+            return {"naplnen": False}
+        kody, nazvy, _, top_kody, top_nazvy = self._stav
+        return {
+            "naplnen": True,
+            "kodu": len(kody),
+            "nazvu": len(nazvy),
+            "predpocitanych_prefixu": len(top_kody) + len(top_nazvy),
+        }
+
+naseptavac = Naseptavac()
+
+
+def naplnit_naseptavac(cursor):
+    cursor.execute(IdIndex.SQL_UZLY)
+    uzly = cursor.fetchall()
+    cursor.execute(IdIndex.SQL_IDS)
+    naseptavac.nastavit(uzly, cursor.fetchall())
+
+
+# --- ÚLOHY NA POZADÍ ---
+# smyčka událostí drží na úlohy jen slabé reference - bez téhle množiny by je mohl
+# garbage collector zahodit dřív, než doběhnou
+_ulohy_na_pozadi = set()
+
+
+def spustit_na_pozadi(coro):
+    """Spustí korutinu jako úlohu, drží na ni referenci do konce a případnou chybu vypíše."""
+    uloha = asyncio.ensure_future(coro)
+    _ulohy_na_pozadi.add(uloha)
+    uloha.add_done_callback(_uloha_dokoncena)
+    return uloha
+
+
+def _uloha_dokoncena(uloha):
+    _ulohy_na_pozadi.discard(uloha)
+    if not uloha.cancelled() and uloha.exception() is not None:
+        print(f"Chyba v úloze na pozadí: {uloha.exception()!r}")
 
 
 # -------------------------------------------
 @app.on_event("startup")
 def startup_db():
-    conn = None
-    for _ in range(10):
-        try:
-            conn = get_db_connection()
-            break
-        except psycopg2.OperationalError:
-            time.sleep(2)
-    
-    if not conn: return
-    cursor = conn.cursor()
+    if REZIM_CTENI:
+        # replika data jen čte: index ze snapshotu nepotřebuje db vůbec
+        snapshot = nacist_snapshot()
+        if snapshot is not None:
+            uzly, ids = snapshot.uzly(), snapshot.ids()
+            id_index.nastavit(uzly, ids)
+            naseptavac.nastavit(uzly, ids)
+            strom_cache.nastavit([u for u in uzly if u[2] in StromCache.TYPY])
+
+    try:
+        inicializovat_pool()
+    except psycopg2.OperationalError:
+        print("Databáze není dostupná, přeskakuji inicializaci.")
+        return
+
+    with db_spojeni() as conn:
+        cursor = conn.cursor()
+        if REZIM_CTENI:
+            # schéma i nahrání dělá zapisující instance
+            if not id_index.naplnen:
+                id_index.naplnit(cursor)
+            print(f"Režim jen pro čtení: index identifikátorů má {id_index.metriky()['hodnot']} hodnot.")
+        else:
+            inicializovat_db(cursor)
+            conn.commit()
+        strom_cache.naplnit(cursor)
+        if not naseptavac.naplnen:
+            naplnit_naseptavac(cursor)
+        cursor.close()
+
+
+@app.on_event("startup")
+async def startup_async_pool():
+    try:
+        await otevrit_async_pool()
+    except PoolTimeout:
+        print("Databáze není dostupná, async pool se neotevřel.")
+
 
+@app.on_event("startup")
+async def startup_obnova_indexu():
+    if not REZIM_CTENI:
+        return
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, lambda: spustit_na_pozadi(obnovit_index()))
+    except (NotImplementedError, RuntimeError, ValueError, AttributeError):
+        # Windows nebo smyčka mimo hlavní vlákno (testy)
+        print("SIGHUP pro obnovu indexu není k dispozici.")
+    if INDEX_OBNOVA_S > 0:
+        spustit_na_pozadi(obnovovat_index_periodicky())
+
+
+@app.on_event("shutdown")
+def shutdown_db():
+    if db_pool is not None:
+        db_pool.zavrit()
+
+
+@app.on_event("shutdown")
+async def shutdown_async_pool():
+    # periodická obnova indexu běží donekonečna, logování pomalých dotazů potřebuje pool
+    for uloha in list(_ulohy_na_pozadi):
+        uloha.cancel()
+    await asyncio.gather(*_ulohy_na_pozadi, return_exceptions=True)
+    if async_pool is not None:
+        await async_pool.close()
+
+
+def inicializovat_db(cursor, pouzit_snapshot=True):
+    """Založí schéma a při prázdné databázi nahraje strom a identifikátory (ze snapshotu, pokud je k dispozici)."""
     # ROZŠÍŘENÍ PRO FUZZY SEARCH (Trigrams) A HIERARCHII (ltree)
     cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm;")
     cursor.execute("CREATE EXTENSION IF NOT EXISTS ltree;")
+    cursor.execute("CREATE EXTENSION IF NOT EXISTS unaccent;")
     
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS geo_locations (
@@ -524,308 +1627,1275 @@ def startup_db():
             priority INTEGER DEFAULT 0
         );
     """)
+    # stav zdrojových CSV pro inkrementální synchronizaci identifikátorů
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS zdroje_stav (
+            zdroj VARCHAR(50) PRIMARY KEY,
+            hash CHAR(64) NOT NULL,
+            aktualizovano TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+    """)
+
+    # který loader řádek vložil (synchronizovat_ids maže jen svoje); NULL = zadáno přes API
+    cursor.execute("SELECT 1 FROM information_schema.columns WHERE table_name = 'ids' AND column_name = 'zdroj';")
+    if cursor.fetchone() is None:
+        cursor.execute("ALTER TABLE ids ADD COLUMN zdroj VARCHAR(20);")
+        # db z doby před sloupcem: všechny zdroje se znovu synchronizují a převezmou svoje řádky
+        cursor.execute("DELETE FROM zdroje_stav;")
+
+    # ltree_path dopočítá trigger z cesty rodiče už při INSERTu (jeden zápis na uzel, žádný UPDATE)
+    cursor.execute("""
+        CREATE OR REPLACE FUNCTION geo_locations_ltree_path() RETURNS trigger AS $$
+        BEGIN
+            IF NEW.ltree_path IS NULL THEN
+                IF NEW.parent_id IS NULL THEN
+                    NEW.ltree_path := NEW.pk_id::text::ltree;
+                ELSE
+                    SELECT p.ltree_path || NEW.pk_id::text INTO NEW.ltree_path
+                    FROM geo_locations p
+                    WHERE p.pk_id = NEW.parent_id;
+                END IF;
+            END IF;
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+    cursor.execute("""
+        CREATE OR REPLACE TRIGGER trg_geo_locations_ltree_path
+        BEFORE INSERT ON geo_locations
+        FOR EACH ROW EXECUTE FUNCTION geo_locations_ltree_path();
+    """)
 
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_ids_value_btree ON ids (value);")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_ids_value_gin ON ids USING GIN (value gin_trgm_ops);")
+    # hledání s filtrem typu i mapy kódů v loaderech (WHERE type = ...) jdou jen přes index
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_ids_type_value ON ids (type, value) INCLUDE (location_pk, priority);")
+
+    # stejný identifikátor nesmí být u jednoho uzlu dvakrát (loadery pak vkládají s ON CONFLICT DO NOTHING)
+    cursor.execute("SELECT to_regclass('uq_ids_location_type_value') IS NULL;")
+    if cursor.fetchone()[0]:
+        cursor.execute("""
+            DELETE FROM ids a USING ids b
+            WHERE a.location_pk = b.location_pk AND a.type = b.type AND a.value = b.value AND a.pk > b.pk;
+        """)
+        if cursor.rowcount:
+            print(f"Odstraněno {cursor.rowcount} duplicitních identifikátorů.")
+        cursor.execute("CREATE UNIQUE INDEX uq_ids_location_type_value ON ids (location_pk, type, value);")
+    # fuzzy hledání řadí podle value <-> dotaz, to umí jen GiST (GIN ne): jeden index přes všechny typy
+    # a částečný index pro každý typ, aby filtrované hledání neprocházelo hodnoty ostatních typů
+    cursor.execute("DROP INDEX IF EXISTS idx_ids_value_gin;")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_ids_value_trgm ON ids USING GIST (value gist_trgm_ops);")
+    for typ_kodu in sorted(set(TYPY_HLEDANI.values())):
+        cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS idx_ids_value_trgm_{typ_kodu.lower()} ON ids USING GIST (value gist_trgm_ops) "
+            f"WHERE type = '{typ_kodu}';"
+        )
     cursor.execute("CREATE INDEX IF NOT EXISTS path_gist_idx ON geo_locations USING GIST (ltree_path);")
+    # ON DELETE CASCADE hledá potomky podle parent_id - bez indexu by to byl průchod tabulkou na každý uzel
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_geo_parent ON geo_locations (parent_id);")
+
+    # hledání podle názvu bez diakritiky a velikosti písmen: unaccent() samo není IMMUTABLE,
+    # proto obal s pevně daným slovníkem, nad kterým jde postavit index
+    cursor.execute("""
+        CREATE OR REPLACE FUNCTION norm_nazev(text) RETURNS text AS $$
+            SELECT lower(public.unaccent('public.unaccent'::regdictionary, $1))
+        $$ LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT;
+    """)
+    # uložený normalizovaný název - hledání pak unaccent nepočítá znovu pro každý řádek
+    cursor.execute("""
+        ALTER TABLE geo_locations
+        ADD COLUMN IF NOT EXISTS nazev_norm text GENERATED ALWAYS AS (norm_nazev(nazev)) STORED;
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_geo_nazev_trgm ON geo_locations USING GIST (nazev_norm gist_trgm_ops);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_geo_nazev_prefix ON geo_locations (nazev_norm text_pattern_ops);")
     
-    conn.commit()
+    cursor.connection.commit()
 
-    # --- NOVÁ TVORBA STROMU POMOCÍ VAZ0043 A MAPA_KRAJU ---
     cursor.execute("SELECT count(*) FROM geo_locations;")
-    if cursor.fetchone()[0] == 0:
+    prazdna = cursor.fetchone()[0] == 0
+
+    snapshot = nacist_snapshot() if pouzit_snapshot else None
+    if snapshot is not None:
+        if prazdna:
+            zacatek = time.perf_counter()
+            obnovit_ze_snapshotu(cursor, snapshot)
+            print(f"Data obnovena ze snapshotu z {snapshot.hlavicka['vytvoreno']} za {time.perf_counter() - zacatek:.2f} s.")
+            return
+        cursor.execute("SELECT hash FROM zdroje_stav WHERE zdroj = 'SNAPSHOT';")
+        row = cursor.fetchone()
+        if row and row[0] == snapshot.hash:
+            print("Data v db odpovídají snapshotu, zdrojová CSV neprocházím.")
+            return
+
+    # --- NOVÁ TVORBA STROMU POMOCÍ VAZ0043 A MAPA_KRAJU ---
+    if prazdna:
         print("Vytvářím stromovou strukturu přímo z VAZ dat a mapy krajů...")
-        
-        # 1. Vložení Krajů
-        kraje_db = {}
-        for kraj_nazev in MAPA_KRAJU.keys():
-            cursor.execute("INSERT INTO geo_locations (parent_id, typ, nazev) VALUES (NULL, 'KRAJ', %s) RETURNING pk_id;", (kraj_nazev,))
-            pk_id = cursor.fetchone()[0]
-            cursor.execute("UPDATE geo_locations SET ltree_path = %s WHERE pk_id = %s;", (str(pk_id), pk_id))
-            kraje_db[kraj_nazev] = pk_id
-
-        # 2. Vložení Okresů
-        okresy_db = {}
-        for kraj_nazev, okresy in MAPA_KRAJU.items():
-            parent_kraj_id = kraje_db[kraj_nazev]
-            for okres_nazev in okresy:
-                cursor.execute("INSERT INTO geo_locations (parent_id, typ, nazev) VALUES (%s, 'OKRES', %s) RETURNING pk_id;", (parent_kraj_id, okres_nazev))
-                pk_id = cursor.fetchone()[0]
-                ltree = f"{parent_kraj_id}.{pk_id}"
-                cursor.execute("UPDATE geo_locations SET ltree_path = %s WHERE pk_id = %s;", (ltree, pk_id))
-                okresy_db[okres_nazev.lower()] = pk_id
-
-        # 3. Vložení Obcí z VAZ s přiřazením ZUJ (LAU2) do správného okresu
-        try:
-            with open('tabulky/VAZ0043_0101_CS.csv', 'r', encoding='utf-8') as f:
-                reader = csv.reader(f)
-                next(reader) 
-                
-                vlozeno = 0
-                for row in reader:
-                    # Sloupec 4 je ZUJ, 5 je Obec, 9 je Okres
-                    zuj = row[4]
-                    nazev_obce = vycistit_nazev(row[5])
-                    nazev_okresu = normalizovat_okres(row[9]).lower()
-                    
-                    if "hlavní město praha" in nazev_okresu:
-                        nazev_okresu = "praha"
-                        
-                    parent_okres_id = okresy_db.get(nazev_okresu)
-                    
-                    if parent_okres_id:
-                        # Vloženi obce pod svuj okres
-                        cursor.execute("INSERT INTO geo_locations (parent_id, typ, nazev) VALUES (%s, 'OBEC', %s) RETURNING pk_id;", (parent_okres_id, nazev_obce))
-                        obec_pk = cursor.fetchone()[0]
-                        
-                        # Generování cesty ltree
-                        cursor.execute("SELECT ltree_path FROM geo_locations WHERE pk_id = %s;", (parent_okres_id,))
-                        parent_path = cursor.fetchone()[0]
-                        cursor.execute("UPDATE geo_locations SET ltree_path = %s WHERE pk_id = %s;", (f"{parent_path}.{obec_pk}", obec_pk))
-                        
-                        # pridani LAU2 kódu do ids
-                        cursor.execute("INSERT INTO ids (location_pk, value, type, priority) VALUES (%s, %s, 'LAU2', 100);", (obec_pk, zuj))
-                        vlozeno += 1
-                        
-            print(f"Strom a LAU2 kódy byly úspěšně nahrány pro {vlozeno} obcí.")
-        except FileNotFoundError:
-            pass
+        nahrat_strom(cursor)
+
+    # 4. Uzly pod obcemi (nahrávají se jen do prázdné db) a doplňkové kódy (synchronizují se podle změny CSV)
+    nahrat_mestske_casti(cursor)
+    nahrat_casti_obci(cursor)
+    synchronizovat_identifikatory(cursor)
+
 
-    # 4. Dodatečné volání doplňkových kódů
+def synchronizovat_identifikatory(cursor):
+    """Projde zdrojová CSV identifikátorů a do ids promítne jen rozdíly oproti poslednímu nahrání."""
     nahrat_ico(cursor)
     nahrat_cis_kody(cursor)
     nahrat_wikidata_qcodes(cursor)
-    nahrat_mestske_casti(cursor) 
-    nahrat_casti_obci(cursor)
     nahrat_psc(cursor)
     nahrat_mesta_obce_cz(cursor)
-    
-    conn.commit()
-    cursor.close()
-    conn.close()
 
 
 # --- ENDPOINTY PRO PŘIDÁNÍ A SMAZÁNÍ LOKACE ---
 
 @app.post("/location", status_code=201)
-def create_location(location: LocationCreate):
+async def create_location(location: LocationCreate):
     """Vytvoří novou lokaci na základě známého kódu rodiče."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    zkontrolovat_zapis()
+    async with async_db_spojeni() as conn:
+        cursor = conn.cursor()
     
-    try:
-        # 1. Najde interní ID rodiče na základě jeho známého kódu (parent_kod)
-        cursor.execute("""
-            SELECT gl.pk_id, gl.ltree_path 
-            FROM ids i
-            JOIN geo_locations gl ON i.location_pk = gl.pk_id
-            WHERE i.value = %s
-            LIMIT 1;
-        """, (location.parent_kod,))
-        
-        parent_row = cursor.fetchone()
+        try:
+            # 1. Najde interní ID rodiče na základě jeho známého kódu (parent_kod)
+            await cursor.execute("""
+                SELECT i.location_pk
+                FROM ids i
+                WHERE i.value = %s
+                LIMIT 1;
+            """, (location.parent_kod,))
         
-        if not parent_row:
-            raise HTTPException(status_code=404, detail=f"Nadřazená lokace s kódem '{location.parent_kod}' nebyla nalezena.")
+            parent_row = await cursor.fetchone()
         
-        parent_pk_id, parent_path = parent_row
+            if not parent_row:
+                raise HTTPException(status_code=404, detail=f"Nadřazená lokace s kódem '{location.parent_kod}' nebyla nalezena.")
         
-        # 2. Vložení nové lokace pomocí nalezeného parent_pk_id
-        cursor.execute(
-            "INSERT INTO geo_locations (parent_id, typ, nazev) VALUES (%s, %s, %s) RETURNING pk_id;",
-            (parent_pk_id, location.typ, location.nazev)
-        )
-        new_id = cursor.fetchone()[0]
+            parent_pk_id = parent_row[0]
         
-        # 3. Aktualizace ltree_path
-        new_path = f"{parent_path}.{new_id}"
-        cursor.execute("UPDATE geo_locations SET ltree_path = %s WHERE pk_id = %s;", (new_path, new_id))
+            # 2. Vložení nové lokace pomocí nalezeného parent_pk_id (ltree_path doplní trigger)
+            await cursor.execute(
+                "INSERT INTO geo_locations (parent_id, typ, nazev) VALUES (%s, %s, %s) RETURNING pk_id, ltree_path;",
+                (parent_pk_id, location.typ, location.nazev)
+            )
+            new_id, new_path = await cursor.fetchone()
         
-        # 4. Vložení identifikátorů do tabulky ids
-        for ident in location.identifikatory:
-            cursor.execute(
-                "INSERT INTO ids (location_pk, value, type, priority) VALUES (%s, %s, %s, %s);",
-                (new_id, ident.value, ident.type, ident.priority)
+            # 3. Vložení identifikátorů do tabulky ids
+            await cursor.executemany(
+                "INSERT INTO ids (location_pk, value, type, priority) VALUES (%s, %s, %s, %s) "
+                "ON CONFLICT (location_pk, type, value) DO NOTHING;",
+                [(new_id, ident.value, ident.type, ident.priority) for ident in location.identifikatory]
             )
         
-        conn.commit()
-        return {"message": f"Lokace '{location.nazev}' byla úspěšně vytvořena.", "ltree_path": new_path}
-    except HTTPException: raise
-    except Exception as e:
-        conn.rollback()
-        raise HTTPException(status_code=500, detail=f"Chyba databáze: {str(e)}")
-    finally:
-        cursor.close()
-        conn.close()
+            await conn.commit()
+            strom_cache.pridat(new_id, location.nazev, location.typ, new_path)
+            odpovedi_cache.zneplatnit_hodnoty(ident.value for ident in location.identifikatory)
+            naseptavac.pridat([(
+                new_id, location.nazev, location.typ, new_path,
+                [(ident.value, ident.type, ident.priority) for ident in location.identifikatory]
+            )])
+            return {"message": f"Lokace '{location.nazev}' byla úspěšně vytvořena.", "ltree_path": new_path}
+        except HTTPException: raise
+        except Exception as e:
+            await conn.rollback()
+            raise HTTPException(status_code=500, detail=f"Chyba databáze: {str(e)}")
+        finally:
+            await cursor.close()
 
 
 @app.delete("/location/{identifier_value}")
-def delete_location(identifier_value: str):
-    """Smaže lokaci podle jakéhokoliv známého identifikátoru (IČO, LAU1, atd.)."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+async def delete_location(identifier_value: str):
+    """Smaže lokaci podle jakéhokoliv známého identifikátoru (IČO, LAU1, atd.) i s celým podstromem."""
+    zkontrolovat_zapis()
+    async with async_db_spojeni() as conn:
+        cursor = conn.cursor()
     
-    try:
-        # Nalezení interního ID a názvu lokace podle zadaného kódu
-        cursor.execute("""
-            SELECT gl.pk_id, gl.nazev, gl.typ
-            FROM ids i
-            JOIN geo_locations gl ON i.location_pk = gl.pk_id
-            WHERE i.value = %s
-            LIMIT 1;
-        """, (identifier_value,))
+        try:
+            # Nalezení interního ID a názvu lokace podle zadaného kódu
+            await cursor.execute("""
+                SELECT gl.pk_id, gl.nazev, gl.typ, gl.ltree_path
+                FROM ids i
+                JOIN geo_locations gl ON i.location_pk = gl.pk_id
+                WHERE i.value = %s
+                LIMIT 1;
+            """, (identifier_value,))
         
-        row = cursor.fetchone()
+            row = await cursor.fetchone()
         
-        if not row:
-            raise HTTPException(status_code=404, detail="Nenalezeno.")
+            if not row:
+                raise HTTPException(status_code=404, detail="Nenalezeno.")
             
-        pk_id, nazev_mazane_lokace, typ_lokace = row
+            pk_id, nazev_mazane_lokace, typ_lokace, ltree_cesta = row
+
+            # Smazání celého podstromu naráz přes ltree (kaskáda pak už nemá co mazat)
+            if ltree_cesta is not None:
+                podstrom = "SELECT pk_id FROM geo_locations WHERE ltree_path <@ %(cesta)s::ltree"
+            else:
+                # řádek z doby před triggerem nemá ltree_path - podstrom se projde přes parent_id
+                podstrom = """
+                    WITH RECURSIVE podstrom AS (
+                        SELECT pk_id FROM geo_locations WHERE pk_id = %(pk)s
+                        UNION ALL
+                        SELECT g.pk_id FROM geo_locations g JOIN podstrom p ON g.parent_id = p.pk_id
+                    )
+                    SELECT pk_id FROM podstrom
+                """
+            parametry = {"cesta": ltree_cesta, "pk": pk_id}
 
-        # Smazání
-        cursor.execute("DELETE FROM geo_locations WHERE pk_id = %s;", (pk_id,))
-        conn.commit()
-        return {"message": f"{typ_lokace} '{nazev_mazane_lokace}' byl smazán."}
-    except HTTPException: raise
-    except Exception as e:
-        conn.rollback()
-        raise HTTPException(status_code=500, detail=f"Chyba databáze: {str(e)}")
-    finally:
-        cursor.close()
-        conn.close()
+            # RETURNING vrátí přesně to, co zmizelo - cache se podle toho upraví bez procházení celých
+            await cursor.execute(
+                f"DELETE FROM ids WHERE location_pk IN ({podstrom}) RETURNING location_pk, value;", parametry
+            )
+            smazane_kody = await cursor.fetchall()
+            await cursor.execute(f"DELETE FROM geo_locations WHERE pk_id IN ({podstrom}) RETURNING pk_id;", parametry)
+            smazane_uzly = [pk for pk, in await cursor.fetchall()]
+            await conn.commit()
+
+            strom_cache.odebrat(smazane_uzly)
+            if ltree_cesta is not None:
+                odpovedi_cache.zneplatnit_podstrom(ltree_cesta)
+            else:
+                odpovedi_cache.vymazat()   # bez cesty nejde poznat, které odpovědi podstrom obsahují
+            naseptavac.odebrat(smazane_uzly, smazane_kody)
+            return {
+                "message": f"{typ_lokace} '{nazev_mazane_lokace}' byl smazán.",
+                "smazano_uzlu": len(smazane_uzly),
+                "smazano_identifikatoru": len(smazane_kody)
+            }
+        except HTTPException: raise
+        except Exception as e:
+            await conn.rollback()
+            raise HTTPException(status_code=500, detail=f"Chyba databáze: {str(e)}")
+        finally:
+            await cursor.close()
+
+
+@app.post("/location/{identifier_value}/move")
+async def move_location(identifier_value: str, presun: LocationMove):
+    """Přesune lokaci i s celým podstromem pod nového rodiče (např. obec do jiného okresu)."""
+    zkontrolovat_zapis()
+    async with async_db_spojeni() as conn:
+        cursor = conn.cursor()
+
+        try:
+            await cursor.execute("""
+                SELECT gl.pk_id, gl.nazev, gl.ltree_path::text
+                FROM ids i
+                JOIN geo_locations gl ON i.location_pk = gl.pk_id
+                WHERE i.value = %s
+                LIMIT 1;
+            """, (identifier_value,))
+            row = await cursor.fetchone()
+            if not row:
+                raise HTTPException(status_code=404, detail="Nenalezeno.")
+            pk_id, nazev, stara_cesta = row
+
+            await cursor.execute("""
+                SELECT gl.pk_id, gl.ltree_path::text
+                FROM ids i
+                JOIN geo_locations gl ON i.location_pk = gl.pk_id
+                WHERE i.value = %s
+                LIMIT 1;
+            """, (presun.novy_parent_kod,))
+            row = await cursor.fetchone()
+            if not row:
+                raise HTTPException(status_code=404, detail=f"Nadřazená lokace s kódem '{presun.novy_parent_kod}' nebyla nalezena.")
+            novy_parent_pk, cesta_rodice = row
+            if stara_cesta is None or cesta_rodice is None:
+                raise HTTPException(status_code=409, detail="Lokace nebo nový rodič nemá ltree_path (řádek z doby před triggerem), přesun nejde provést.")
+            if cesta_rodice == stara_cesta or cesta_rodice.startswith(stara_cesta + '.'):
+                raise HTTPException(status_code=400, detail="Lokaci nejde přesunout pod ni samotnou ani pod jejího potomka.")
+
+            # nová cesta = cesta nového rodiče + zbytek cesty od přesouvaného uzlu dolů, jedním UPDATE
+            await cursor.execute("""
+                UPDATE geo_locations
+                SET ltree_path = %(rodic)s::ltree || subpath(ltree_path, nlevel(%(stara)s::ltree) - 1),
+                    parent_id = CASE WHEN pk_id = %(pk)s THEN %(novy_parent)s ELSE parent_id END
+                WHERE ltree_path <@ %(stara)s::ltree
+                RETURNING pk_id, ltree_path::text;
+            """, {"rodic": cesta_rodice, "stara": stara_cesta, "pk": pk_id, "novy_parent": novy_parent_pk})
+            nove_cesty = await cursor.fetchall()
+            await conn.commit()
+
+            nova_cesta = f"{cesta_rodice}.{pk_id}"
+            # změnily se cesty celého podstromu: cache jen přepíšou cesty přesunutých uzlů, odpovědi pryč
+            strom_cache.presunout(nove_cesty)
+            odpovedi_cache.vymazat()
+            naseptavac.presunout(nove_cesty)
+            return {
+                "message": f"'{nazev}' byl přesunut.",
+                "presunuto_uzlu": len(nove_cesty),
+                "stara_cesta": stara_cesta,
+                "nova_cesta": nova_cesta
+            }
+        except HTTPException: raise
+        except Exception as e:
+            await conn.rollback()
+            raise HTTPException(status_code=500, detail=f"Chyba databáze: {str(e)}")
+        finally:
+            await cursor.close()
+
+
+# --- HROMADNÝ IMPORT LOKACÍ ---
+IMPORT_MAX = int(os.getenv("IMPORT_MAX", "200000"))   # max. řádků v jednom importu
+IMPORT_MAX_BAJTU = int(os.getenv("IMPORT_MAX_BAJTU", 128 * 1024 * 1024))   # max. velikost těla importu
+IMPORT_PRESTAVET_NASEPTAVAC = 1000                     # od kolika uzlů se našeptávač přestaví celý místo insortu
+
+
+def parsovat_import(telo, format, oddelovac=",", max_zaznamu=None):
+    """
+    NDJSON (řádek = LocationCreate jako JSON) nebo CSV se sloupci nazev, typ, parent_kod, identifikatory
+    (identifikatory ve tvaru TYP:hodnota[:priorita]|TYP:hodnota...). Vrací ([(cislo_radku, LocationCreate)], chyby).
+    S max_zaznamu se parsování zastaví po max_zaznamu + 1 záznamech (volající pozná překročení podle počtu).
+    """
+    polozky, chyby = [], []
+    if format == "csv":
+        reader = csv.DictReader(io.StringIO(telo), delimiter=oddelovac)
+        zaznamy = ((reader.line_num, row) for row in reader)
+    else:
+        zaznamy = ((i, radek) for i, radek in enumerate(telo.split("\n"), start=1) if radek.strip())
+    if max_zaznamu is not None:
+        zaznamy = itertools.islice(zaznamy, max_zaznamu + 1)
+
+    for cislo_radku, zaznam in zaznamy:
+        try:
+            if format == "csv":
+                identifikatory = []
+                for polozka in filter(None, (zaznam.get('identifikatory') or '').split('|')):
+                    typ_kodu, _, hodnota = polozka.strip().partition(':')
+                    ident = {"type": typ_kodu, "value": hodnota}
+                    zbytek, _, priorita = hodnota.rpartition(':')
+                    if zbytek and priorita.isdigit():
+                        ident.update(value=zbytek, priority=int(priorita))
+                    identifikatory.append(ident)
+                data = {"nazev": (zaznam.get('nazev') or '').strip(), "typ": (zaznam.get('typ') or 'OBEC').strip(),
+                        "parent_kod": (zaznam.get('parent_kod') or '').strip(), "identifikatory": identifikatory}
+            else:
+                data = json.loads(zaznam)
+            polozky.append((cislo_radku, LocationCreate(**data)))
+        except (ValueError, TypeError, ValidationError) as e:
+            chyby.append({"radek": cislo_radku, "chyba": f"Neplatný záznam: {e}"})
+    return polozky, chyby
+
+
+def kontrola_lokace(location):
+    """Chyba, kvůli které by řádek neprošel do db (délky sloupců, prázdné hodnoty), jinak None."""
+    if not location.nazev or len(location.nazev) > 255:
+        return "nazev musí mít 1-255 znaků"
+    if not location.typ or len(location.typ) > 50:
+        return "typ musí mít 1-50 znaků"
+    for ident in location.identifikatory:
+        if not ident.value or len(ident.value) > 50 or not ident.type or len(ident.type) > 20:
+            return f"identifikátor {ident.type}:{ident.value} - hodnota musí mít 1-50 a typ 1-20 znaků"
+    return None
+
+
+def importovat_lokace(cursor, polozky):
+    """
+    Vloží uzly i s identifikátory v transakci volajícího. Rodiče se hledají jedním dotazem do db,
+    nebo mezi dřívějšími řádky téhož importu (podle jejich identifikátorů). pk_id se přidělí ze
+    sekvence předem, takže ltree_path se spočítá tady a uzly i kódy jdou do db přes COPY.
+    Vrací (vlozene [(pk_id, LocationCreate, ltree_path)], pocet_novych_identifikatoru, chyby).
+    """
+    chyby = []
+    cursor.execute("""
+        SELECT DISTINCT ON (i.value) i.value, gl.pk_id, gl.ltree_path::text
+        FROM ids i
+        JOIN geo_locations gl ON i.location_pk = gl.pk_id
+        WHERE i.value = ANY(%s)
+        ORDER BY i.value, i.priority DESC;
+    """, (list({location.parent_kod for _, location in polozky}),))
+    rodice_z_db = {value: (pk_id, cesta) for value, pk_id, cesta in cursor.fetchall()}
+
+    # 1. průchod: které řádky projdou (rodič z importu musí být dřív a sám bez chyby)
+    platne = []
+    kody_platnych = {}   # hodnota -> index v platne
+    for cislo_radku, location in polozky:
+        chyba = kontrola_lokace(location)
+        if chyba is None and location.parent_kod not in kody_platnych and location.parent_kod not in rodice_z_db:
+            chyba = f"Nadřazená lokace s kódem '{location.parent_kod}' nebyla nalezena."
+        if chyba:
+            chyby.append({"radek": cislo_radku, "chyba": chyba})
+            continue
+        for ident in location.identifikatory:
+            kody_platnych.setdefault(ident.value, len(platne))
+        platne.append(location)
+
+    if not platne:
+        return [], 0, chyby
+
+    # 2. průchod: pk_id ze sekvence a cesty
+    cursor.execute(
+        "SELECT nextval(pg_get_serial_sequence('geo_locations', 'pk_id')) FROM generate_series(1, %s);",
+        (len(platne),)
+    )
+    pk_ids = [row[0] for row in cursor.fetchall()]
+    vlozene = []
+    kody_importu = {}
+    for pk_id, location in zip(pk_ids, platne):
+        if location.parent_kod in kody_importu:
+            parent_pk, parent_cesta = kody_importu[location.parent_kod]
+        else:
+            parent_pk, parent_cesta = rodice_z_db[location.parent_kod]
+        cesta = f"{parent_cesta}.{pk_id}"
+        vlozene.append((pk_id, location, cesta, parent_pk))
+        for ident in location.identifikatory:
+            kody_importu.setdefault(ident.value, (pk_id, cesta))
+
+    copy_do_tabulky(cursor, 'geo_locations', ['pk_id', 'parent_id', 'typ', 'nazev', 'ltree_path'], (
+        (pk_id, parent_pk, location.typ, location.nazev, cesta) for pk_id, location, cesta, parent_pk in vlozene
+    ))
+    copy_do_stagingu(cursor, 'stg_import_ids', ['location_pk', 'value', 'type', 'priority'], (
+        (pk_id, ident.value, ident.type, ident.priority)
+        for pk_id, location, _, _ in vlozene for ident in location.identifikatory
+    ))
+    cursor.execute("""
+        INSERT INTO ids (location_pk, value, type, priority)
+        SELECT location_pk::int, value, type, priority::int FROM stg_import_ids ORDER BY poradi
+        ON CONFLICT (location_pk, type, value) DO NOTHING;
+    """)
+    novych_identifikatoru = cursor.rowcount
+    cursor.execute("DROP TABLE stg_import_ids;")
+
+    return [(pk_id, location, cesta) for pk_id, location, cesta, _ in vlozene], novych_identifikatoru, chyby
+
+
+@app.post("/location/bulk", status_code=201)
+async def bulk_create_locations(
+    request: Request,
+    format: str = Query(None, regex="^(ndjson|csv)$"),
+    oddelovac: str = Query(",", min_length=1, max_length=1)):
+    """
+    Hromadně vytvoří lokace z NDJSON nebo CSV (formát podle parametru, jinak podle Content-Type).
+    Platné řádky se vloží v jedné transakci, chybné se vrátí v seznamu chyb s číslem řádku.
+    """
+    zkontrolovat_zapis()
+    if format is None:
+        format = "csv" if "csv" in request.headers.get("content-type", "") else "ndjson"
+    # velikost se hlídá už při čtení: Content-Length může chybět (chunked) nebo lhát
+    prilis_velke = HTTPException(status_code=413, detail=f"Tělo importu může mít nejvýš {IMPORT_MAX_BAJTU} bajtů.")
+    delka = request.headers.get("content-length")
+    if delka is not None and delka.isdigit() and int(delka) > IMPORT_MAX_BAJTU:
+        raise prilis_velke
+    kusy, prijato = [], 0
+    async for kus in request.stream():
+        prijato += len(kus)
+        if prijato > IMPORT_MAX_BAJTU:
+            raise prilis_velke
+        kusy.append(kus)
+    try:
+        telo = b"".join(kusy).decode('utf-8-sig')
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="Soubor musí být v UTF-8.")
+    del kusy
+
+    polozky, chyby = parsovat_import(telo, format, oddelovac, max_zaznamu=IMPORT_MAX)
+    if len(polozky) + len(chyby) > IMPORT_MAX:
+        raise HTTPException(status_code=413, detail=f"Maximálně {IMPORT_MAX} řádků v jednom importu.")
+
+    def v_transakci():
+        with db_spojeni() as conn:
+            cursor = conn.cursor()
+            try:
+                vysledek = importovat_lokace(cursor, polozky)
+                conn.commit()
+                if len(vysledek[0]) >= IMPORT_PRESTAVET_NASEPTAVAC:
+                    naplnit_naseptavac(cursor)
+                return vysledek
+            except Exception as e:
+                conn.rollback()
+                raise HTTPException(status_code=500, detail=f"Chyba databáze: {str(e)}")
+            finally:
+                cursor.close()
+
+    vlozene, novych_identifikatoru, chyby_db = await asyncio.to_thread(v_transakci)
+    chyby = sorted(chyby + chyby_db, key=lambda c: c["radek"])
+    if not vlozene and chyby:
+        raise HTTPException(status_code=422, detail={"message": "Žádný řádek nešel vložit.", "chyby": chyby[:1000]})
+
+    # cache se aktualizují až ve smyčce událostí (stejně jako u create_location)
+    for pk_id, location, cesta in vlozene:
+        strom_cache.pridat(pk_id, location.nazev, location.typ, cesta)
+    if len(vlozene) < IMPORT_PRESTAVET_NASEPTAVAC:
+        naseptavac.pridat([
+            (pk_id, location.nazev, location.typ, cesta,
+             [(ident.value, ident.type, ident.priority) for ident in location.identifikatory])
+            for pk_id, location, cesta in vlozene
+        ])
+    odpovedi_cache.zneplatnit_hodnoty(ident.value for _, location, _ in vlozene for ident in location.identifikatory)
+
+    return {
+        "message": f"Vytvořeno {len(vlozene)} lokací.",
+        "vlozeno": len(vlozene),
+        "identifikatoru": novych_identifikatoru,
+        "chyb": len(chyby),
+        "chyby": chyby[:1000]
+    }
+
+
+@app.post("/sync/ids")
+def sync_ids():
+    """Znovu projde zdrojová CSV identifikátorů a do ids promítne jen změny (bez restartu a přenahrání db)."""
+    zkontrolovat_zapis()
+    with db_spojeni() as conn:
+        cursor = conn.cursor()
+        try:
+            synchronizovat_identifikatory(cursor)
+            conn.commit()
+            odpovedi_cache.vymazat()
+            naplnit_naseptavac(cursor)
+            cursor.execute("SELECT zdroj, aktualizovano FROM zdroje_stav ORDER BY zdroj;")
+            return {"zdroje": {zdroj: aktualizovano.isoformat() for zdroj, aktualizovano in cursor.fetchall()}}
+        except Exception as e:
+            conn.rollback()
+            raise HTTPException(status_code=500, detail=f"Chyba databáze: {str(e)}")
+        finally:
+            cursor.close()
 
 
 # --- VYHLEDÁVACÍ ENDPOINT ---
 
-@app.get("/search/{query}")
-def search_id(
-    query: str, 
-    search_type: str = Query(None, regex="^(ico|zuj|lau2|nuts3|lau1|ruian|qcode|geonames|momc|kod_cobce|psc|mesta_obce)$")):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
-    db_type_filter = None
-    if search_type:
-        search_type = search_type.lower()
-        if search_type in ['zuj', 'lau2']: db_type_filter = 'LAU2'
-        elif search_type == 'ico': db_type_filter = 'ICO'
-        elif search_type == 'nuts3': db_type_filter = 'NUTS3'
-        elif search_type == 'lau1': db_type_filter = 'LAU1'
-        elif search_type == 'ruian': db_type_filter = 'RUIAN'
-        elif search_type == 'qcode': db_type_filter = 'QCODE'
-        elif search_type == 'geonames': db_type_filter = 'GEONAMES'
-        elif search_type == 'momc': db_type_filter = 'MOMC'
-        elif search_type == 'kod_cobce': db_type_filter = 'KOD_COBCE'
-        elif search_type == 'psc': db_type_filter = 'PSC'
-        elif search_type == 'mesta_obce': db_type_filter = 'MESTA_OBCE'
-        
-    hledany_dotaz = query.replace(" ", "").strip()
+# search_type z URL -> hodnota ids.type
+TYPY_HLEDANI = {
+    'zuj': 'LAU2', 'lau2': 'LAU2', 'ico': 'ICO', 'nuts3': 'NUTS3', 'lau1': 'LAU1',
+    'ruian': 'RUIAN', 'qcode': 'QCODE', 'geonames': 'GEONAMES', 'momc': 'MOMC',
+    'kod_cobce': 'KOD_COBCE', 'psc': 'PSC', 'mesta_obce': 'MESTA_OBCE',
+}
+
+FUZZY_KANDIDATU = 50   # kolik nejbližších hodnot vrátí KNN průchod indexem, než se přeřadí i podle priority
 
-    # exact match
+def sql_fuzzy_kandidati(db_type_filter, hodnota="%s"):
+    """
+    Nejbližší hodnoty podle trigramové vzdálenosti - čisté ORDER BY value <-> dotaz, aby šlo
+    o KNN průchod GiST indexem. Typ je v SQL jako literál (jen z TYPY_HLEDANI): s parametrem by
+    generický plán připraveného dotazu nemohl použít částečný index daného typu.
+    """
+    podminka = f"WHERE i.type = '{db_type_filter}'" if db_type_filter else ""
+    return f"""
+        SELECT i.location_pk, i.value, i.type, i.priority, (i.value <-> {hodnota}) AS vzdalenost
+        FROM ids i
+        {podminka}
+        ORDER BY i.value <-> {hodnota}
+        LIMIT {FUZZY_KANDIDATU}
+    """
+
+def pripravit_dotaz(query):
+    """Vrátí (normalizovaný dotaz, hodnoty pro přesnou shodu) - čísla kratší než 8 znaků i doplněná nulami (IČO)."""
+    hledany_dotaz = query.replace(" ", "").strip()
     hledane_hodnoty = [hledany_dotaz]
     if hledany_dotaz.isdigit() and len(hledany_dotaz) < 8:
         hledane_hodnoty.append(hledany_dotaz.zfill(8))
+    return hledany_dotaz, hledane_hodnoty
+
+async def sestavit_cesty(cursor, ltree_cesty):
+    """Sestaví textové cesty předků ("Kraj (KRAJ) > Okres (OKRES)") pro všechny výsledky jedním dotazem."""
+    cesty = [c for c in set(ltree_cesty) if c]
+    if not cesty:
+        return {}
+
+    # nejdřív z cache horní části stromu, do db jen s tím, co v ní není
+    if not strom_cache.naplnena:
+        await strom_cache.naplnit_async(cursor)
+    vysledek, cesty = strom_cache.cesty(cesty)
+    if not cesty:
+        return vysledek
+
+    # všichni předci všech cest najednou (ltree @> ltree[] umí GiST index)
+    await cursor.execute(
+        "SELECT ltree_path::text, nazev, typ FROM geo_locations WHERE ltree_path @> %s::ltree[];",
+        (cesty,)
+    )
+    uzly_podle_cesty = {row[0]: f"{row[1]} ({row[2]})" for row in await cursor.fetchall()}
 
-    sql_exact = """
-        SELECT gl.nazev, i.value, i.type, i.priority, gl.typ, gl.ltree_path 
-        FROM ids i
-        JOIN geo_locations gl ON i.location_pk = gl.pk_id
-        WHERE i.value = ANY(%s)
-    """
-    params_exact = [hledane_hodnoty]
+    for cesta in cesty:
+        casti = cesta.split('.')
+        rodice_seznam = []
+        for i in range(1, len(casti)):
+            rodic = uzly_podle_cesty.get('.'.join(casti[:i]))
+            if rodic:
+                rodice_seznam.append(rodic)
+        vysledek[cesta] = " > ".join(rodice_seznam) if rodice_seznam else "Kořenový uzel"
+    return vysledek
+
+
+# --- INSTRUMENTACE VYHLEDÁVÁNÍ ---
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "0"))   # požadavky delší než tohle se zalogují i s EXPLAIN, 0 = vypnuto
+
+BUCKETY_S = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+HIST_FAZE = Histogram("obec_search_faze_sekundy", "Doba jednotlivých fází /search/{query}", ["faze"], buckets=BUCKETY_S)
+HIST_POZADAVKY = Histogram(
+    "obec_search_sekundy", "Celková doba /search/{query}", ["vysledek", "zdroj", "filtr"], buckets=BUCKETY_S
+)
+HIST_RADKY = Histogram(
+    "obec_search_radky", "Řádky načtené z db a vrácené klientovi", ["druh"], buckets=(0, 1, 2, 5, 10, 20, 50, 100, 500)
+)
+
+
+class MereniHledani:
+    """Časy fází jednoho požadavku /search, počty řádků a SQL pro případný slow-query log."""
+
+    def __init__(self):
+        self.zacatek = time.perf_counter()
+        self.faze = {}
+        self.sql = []          # (sql, parametry)
+        self.radky_z_db = 0
+        self.zdroj = "db"      # db / index / cache
+
+    @contextmanager
+    def mer(self, faze):
+        zacatek = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.faze[faze] = self.faze.get(faze, 0) + time.perf_counter() - zacatek
+
+    async def dotaz(self, cursor, sql, parametry, faze):
+        with self.mer(faze):
+            self.sql.append((sql, parametry))
+            await cursor.execute(sql, parametry)
+            radky = await cursor.fetchall()
+        self.radky_z_db += len(radky)
+        return radky
+
+    def dokoncit(self, vysledek, filtr, vraceno):
+        celkem = time.perf_counter() - self.zacatek
+        for faze, trvani in self.faze.items():
+            HIST_FAZE.labels(faze).observe(trvani)
+        HIST_POZADAVKY.labels(vysledek, self.zdroj, filtr).observe(celkem)
+        HIST_RADKY.labels("z_db").observe(self.radky_z_db)
+        HIST_RADKY.labels("vraceno").observe(vraceno)
+        return celkem * 1000
+
+
+async def zalogovat_pomaly_dotaz(query, trvani_ms, mereni):
+    """Vypíše časy fází a EXPLAIN všech SQL pomalého požadavku (běží mimo request, s vlastním spojením)."""
+    faze = ", ".join(f"{nazev} {trvani * 1000:.1f} ms" for nazev, trvani in mereni.faze.items())
+    zaznam = [f"POMALÝ DOTAZ /search/{query}: {trvani_ms:.1f} ms ({faze}), řádků z db {mereni.radky_z_db}"]
+    try:
+        async with async_db_spojeni() as conn:
+            async with conn.cursor() as cursor:
+                for sql, parametry in mereni.sql:
+                    await cursor.execute("EXPLAIN " + sql, parametry)
+                    plan = "\n    ".join(row[0] for row in await cursor.fetchall())
+                    zaznam.append(f"  SQL: {' '.join(sql.split())}\n  parametry: {parametry}\n    {plan}")
+    except Exception as e:
+        zaznam.append(f"  EXPLAIN se nepodařil: {e}")
+    print("\n".join(zaznam))
 
-    if db_type_filter:
-        sql_exact += " AND i.type = %s"
-        params_exact.append(db_type_filter)
-    
-    sql_exact += " ORDER BY i.priority DESC;"
 
-    cursor.execute(sql_exact, tuple(params_exact))
-    presne_vysledky = cursor.fetchall()
+@app.get("/search/{query}")
+async def search_id(
+    query: str, 
+    search_type: str = Query(None, regex="^(ico|zuj|lau2|nuts3|lau1|ruian|qcode|geonames|momc|kod_cobce|psc|mesta_obce)$")):
+    db_type_filter = TYPY_HLEDANI.get(search_type.lower()) if search_type else None
+    filtr = db_type_filter if db_type_filter else "all"
+    mereni = MereniHledani()
 
-    if presne_vysledky:
-        response_data = []
-        for row in presne_vysledky:
-            nazev, kod, typ_kodu, priorita, typ_uzlu, ltree_cesta = row
+    try:
+        odpoved = await vyhledat(query, db_type_filter, mereni)
+    except HTTPException as e:
+        trvani_ms = mereni.dokoncit("404" if e.status_code == 404 else str(e.status_code), filtr, 0)
+        if SLOW_QUERY_MS and trvani_ms > SLOW_QUERY_MS:
+            spustit_na_pozadi(zalogovat_pomaly_dotaz(query, trvani_ms, mereni))
+        raise
+
+    # serializaci děláme tady, aby šla změřit (FastAPI by ji jinak dělal až po návratu)
+    with mereni.mer("serializace"):
+        response = JSONResponse(odpoved)
+    trvani_ms = mereni.dokoncit(odpoved["status"].replace("_match", ""), filtr, len(odpoved["results"]))
+    if SLOW_QUERY_MS and trvani_ms > SLOW_QUERY_MS:
+        spustit_na_pozadi(zalogovat_pomaly_dotaz(query, trvani_ms, mereni))
+    return response
+
+
+async def vyhledat(query, db_type_filter, mereni):
+    hledany_dotaz, hledane_hodnoty = pripravit_dotaz(query)
+
+    with mereni.mer("cache"):
+        klic_cache = (hledany_dotaz, db_type_filter)
+        odpoved = odpovedi_cache.ziskat(klic_cache)
+    if odpoved is not None:
+        mereni.zdroj = "cache"
+        return odpoved
+    verze_cache = odpovedi_cache.verze
+
+    # replika jen pro čtení: přesná shoda z paměti, do db jde jen fuzzy
+    if REZIM_CTENI and id_index.naplnen:
+        with mereni.mer("index"):
+            response_data = id_index.hledat(hledane_hodnoty, db_type_filter)
+        if response_data:
+            mereni.zdroj = "index"
+            odpoved = {
+                "status": "exact_match",
+                "filter": db_type_filter if db_type_filter else "all",
+                "count": len(response_data),
+                "results": response_data
+            }
+            # index se mění jen celý při obnově (ta cache maže), cesty tu nejsou potřeba
+            odpovedi_cache.ulozit(klic_cache, odpoved, hledane_hodnoty, (), verze_cache)
+            return odpoved
+
+    async with async_db_spojeni() as conn:
+        cursor = conn.cursor()
+
+        # exact match
+        sql_exact = """
+            SELECT gl.nazev, i.value, i.type, i.priority, gl.typ, gl.ltree_path 
+            FROM ids i
+            JOIN geo_locations gl ON i.location_pk = gl.pk_id
+            WHERE i.value = ANY(%s)
+        """
+        params_exact = [hledane_hodnoty]
 
-            rodice_seznam = []
-            if ltree_cesta:
-                sql_rodice = "SELECT nazev, typ FROM geo_locations WHERE ltree_path @> %s AND ltree_path != %s ORDER BY nlevel(ltree_path) ASC;"
-                cursor.execute(sql_rodice, (ltree_cesta, ltree_cesta))
-                for r in cursor.fetchall():
-                    rodice_seznam.append(f"{r[0]} ({r[1]})")
+        if db_type_filter:
+            sql_exact += " AND i.type = %s"
+            params_exact.append(db_type_filter)
+    
+        sql_exact += " ORDER BY i.priority DESC;"
+
+        presne_vysledky = await mereni.dotaz(cursor, sql_exact, tuple(params_exact), "exact")
+
+        if presne_vysledky:
+            with mereni.mer("cesty"):
+                cesty = await sestavit_cesty(cursor, [row[5] for row in presne_vysledky])
+
+            response_data = []
+            for row in presne_vysledky:
+                nazev, kod, typ_kodu, priorita, typ_uzlu, ltree_cesta = row
+
+                response_data.append({
+                    "obec": nazev,
+                    "kod": kod,
+                    "typ": typ_kodu,
+                    "typ_uzlu": typ_uzlu,
+                    "shoda": "100 %",
+                    "cesta": cesty.get(ltree_cesta, "Kořenový uzel")
+                })
+
+            await cursor.close()
+            odpoved = {
+                "status": "exact_match",
+                "filter": db_type_filter if db_type_filter else "all",
+                "count": len(response_data),
+                "results": response_data
+            }
+            odpovedi_cache.ulozit(klic_cache, odpoved, hledane_hodnoty, [row[5] for row in presne_vysledky], verze_cache)
+            return odpoved
+
+        # FUZZY VYHLEDÁVÁNÍ
+        sql_fuzzy_final = f"""
+            SELECT gl.nazev, k.value, k.type, k.vzdalenost, gl.typ, gl.ltree_path
+            FROM ({sql_fuzzy_kandidati(db_type_filter)}) k
+            JOIN geo_locations gl ON k.location_pk = gl.pk_id
+            ORDER BY k.vzdalenost ASC, k.priority DESC LIMIT 5;
+        """
+        query_params = (hledany_dotaz, hledany_dotaz)
+
+        vysledky_fuzzy = await mereni.dotaz(cursor, sql_fuzzy_final, query_params, "fuzzy")
+
+        if not vysledky_fuzzy:
+            await cursor.close()
+            raise HTTPException(status_code=404, detail="Nic nenalezeno.")
+
+        with mereni.mer("cesty"):
+            cesty = await sestavit_cesty(cursor, [row[5] for row in vysledky_fuzzy])
+
+        response_data = []
+        for row in vysledky_fuzzy:
+            nazev, kod, typ_kodu, vzdalenost, typ_uzlu, ltree_cesta = row
+            shoda_procenta = round((1 - vzdalenost) * 100, 2)
+            if shoda_procenta < 10: continue
 
             response_data.append({
                 "obec": nazev,
                 "kod": kod,
                 "typ": typ_kodu,
                 "typ_uzlu": typ_uzlu,
-                "shoda": "100 %",
-                "cesta": " > ".join(rodice_seznam) if rodice_seznam else "Kořenový uzel"
+                "shoda": f"{shoda_procenta} %",
+                "cesta": cesty.get(ltree_cesta, "Kořenový uzel")
             })
 
-        cursor.close()
-        conn.close()
-        return {
-            "status": "exact_match",
+        await cursor.close()
+
+        if not response_data:
+            raise HTTPException(status_code=404, detail="Nic dostatečně podobného nenalezeno.")
+
+        odpoved = {
+            "status": "fuzzy_match",
             "filter": db_type_filter if db_type_filter else "all",
-            "count": len(response_data),
             "results": response_data
         }
-
-    # FUZZY VYHLEDÁVÁNÍ
-    sql_fuzzy_final = """
-        SELECT gl.nazev, i.value, i.type, (i.value <-> %s) as vzdalenost, gl.typ, gl.ltree_path
-        FROM ids i
-        JOIN geo_locations gl ON i.location_pk = gl.pk_id
+        odpovedi_cache.ulozit(klic_cache, odpoved, hledane_hodnoty, [row[5] for row in vysledky_fuzzy], verze_cache)
+        return odpoved
+
+# --- HLEDÁNÍ PODLE NÁZVU ---
+NAZEV_KANDIDATU = 200   # kolik nejbližších názvů vrátí KNN průchod indexem před přeřazením
+
+@app.get("/search/name/{query}")
+async def search_name(
+    query: str,
+    typ: str = Query(None, regex="^(KRAJ|OKRES|OBEC|MESTSKA_CAST|CAST_OBCE)$"),
+    prefix: bool = False,
+    limit: int = Query(10, ge=1, le=50)):
     """
-    query_params = [hledany_dotaz]
-    
-    if db_type_filter:
-        sql_fuzzy_final += " WHERE i.type = %s "
-        query_params.append(db_type_filter)
-        
-    sql_fuzzy_final += " ORDER BY (i.value <-> %s) ASC, i.priority DESC LIMIT 5;"
-    query_params.append(hledany_dotaz)
-
-    cursor.execute(sql_fuzzy_final, tuple(query_params))
-    vysledky_fuzzy = cursor.fetchall()
-
-    if not vysledky_fuzzy:
-        cursor.close()
-        conn.close()
-        raise HTTPException(status_code=404, detail="Nic nenalezeno.")
+    Hledá uzly podle názvu bez ohledu na diakritiku a velikost písmen ("zdar nad sazavou", "usti").
+    prefix=true je režim pro našeptávání (názvy začínající dotazem), jinak trigramová podobnost
+    slova v názvu. Řadí se podle podobnosti, pak podle úrovně ve stromu (obec před částí obce).
+    """
+    dotaz = " ".join(query.split())
+    if not dotaz:
+        raise HTTPException(status_code=422, detail="Prázdný dotaz.")
+
+    # typ je z regexu výše, v SQL jako literál kvůli plánu (stejně jako u fuzzy hledání kódů)
+    podminka_typ = f"AND gl.typ = '{typ}'" if typ else ""
+    if prefix:
+        # u názvů začínajících dotazem je podobnost tím vyšší, čím je název kratší
+        sql = f"""
+            SELECT gl.pk_id, gl.nazev, gl.typ, gl.ltree_path,
+                   similarity(gl.nazev_norm, %(vzor_norm)s) AS podobnost
+            FROM geo_locations gl
+            WHERE gl.nazev_norm LIKE %(vzor)s {podminka_typ}
+            ORDER BY length(gl.nazev_norm), nlevel(gl.ltree_path), gl.nazev
+            LIMIT %(limit)s
+        """
+    else:
+        sql = f"""
+            SELECT k.pk_id, k.nazev, k.typ, k.ltree_path, 1 - k.vzdalenost AS podobnost
+            FROM (
+                SELECT gl.pk_id, gl.nazev, gl.typ, gl.ltree_path,
+                       norm_nazev(%(q)s) <<-> gl.nazev_norm AS vzdalenost,
+                       gl.nazev_norm <-> norm_nazev(%(q)s) AS vzdalenost_celeho
+                FROM geo_locations gl
+                WHERE TRUE {podminka_typ}
+                ORDER BY norm_nazev(%(q)s) <<-> gl.nazev_norm
+                LIMIT {NAZEV_KANDIDATU}
+            ) k
+            WHERE k.vzdalenost < 0.9
+            ORDER BY k.vzdalenost, nlevel(k.ltree_path), k.vzdalenost_celeho, k.nazev
+            LIMIT %(limit)s
+        """
+
+    async with async_db_spojeni() as conn:
+        async with conn.cursor() as cursor:
+            vzor = normalizovany = None
+            if prefix:
+                # vzor pro LIKE musí být konstanta (jinak se nepoužije index): normalizace v db, escapování %, _ a \
+                await cursor.execute("SELECT norm_nazev(%s);", (dotaz,))
+                normalizovany = (await cursor.fetchone())[0]
+                vzor = normalizovany.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+            await cursor.execute(sql, {"q": dotaz, "vzor": vzor, "vzor_norm": normalizovany, "limit": limit})
+            radky = await cursor.fetchall()
+            if not radky:
+                raise HTTPException(status_code=404, detail="Nic nenalezeno.")
+
+            # hlavní identifikátor každého uzlu (nejvyšší priorita)
+            await cursor.execute("""
+                SELECT DISTINCT ON (location_pk) location_pk, value, type
+                FROM ids WHERE location_pk = ANY(%s)
+                ORDER BY location_pk, priority DESC;
+            """, ([row[0] for row in radky],))
+            kody = {row[0]: (row[1], row[2]) for row in await cursor.fetchall()}
+            cesty = await sestavit_cesty(cursor, [row[3] for row in radky])
 
     response_data = []
-    for row in vysledky_fuzzy:
-        nazev, kod, typ_kodu, vzdalenost, typ_uzlu, ltree_cesta = row
-        shoda_procenta = round((1 - vzdalenost) * 100, 2)
-        if shoda_procenta < 10: continue
-
-        rodice_seznam = []
-        if ltree_cesta:
-            sql_rodice = "SELECT nazev, typ FROM geo_locations WHERE ltree_path @> %s AND ltree_path != %s ORDER BY nlevel(ltree_path) ASC;"
-            cursor.execute(sql_rodice, (ltree_cesta, ltree_cesta))
-            for r in cursor.fetchall():
-                rodice_seznam.append(f"{r[0]} ({r[1]})")
-
+    for pk_id, nazev, typ_uzlu, ltree_cesta, podobnost in radky:
+        kod, typ_kodu = kody.get(pk_id, (None, None))
         response_data.append({
             "obec": nazev,
             "kod": kod,
             "typ": typ_kodu,
             "typ_uzlu": typ_uzlu,
-            "shoda": f"{shoda_procenta} %",
-            "cesta": " > ".join(rodice_seznam) if rodice_seznam else "Kořenový uzel"
+            "shoda": f"{round(podobnost * 100, 2)} %",
+            "cesta": cesty.get(ltree_cesta, "Kořenový uzel")
+        })
+
+    return {
+        "status": "prefix_match" if prefix else "name_match",
+        "filter": typ if typ else "all",
+        "count": len(response_data),
+        "results": response_data
+    }
+
+
+# --- NAŠEPTÁVÁNÍ ---
+
+@app.get("/suggest")
+async def suggest(
+    q: str = Query(..., min_length=1, max_length=100),
+    k: int = Query(10, ge=1, le=NASEPTAVAC_K_MAX),
+    druh: str = Query(None, regex="^(kod|nazev)$")):
+    """Našeptávání při psaní: kódy a názvy začínající na q, top-k podle priority, bez dotazu do db."""
+    if not naseptavac.naplnen:
+        raise HTTPException(status_code=503, detail="Našeptávač se ještě načítá.")
+    vysledky = naseptavac.hledat(q, k, druh)
+    return {"query": q, "count": len(vysledky), "results": vysledky}
+
+
+# --- DÁVKOVÉ VYHLEDÁVÁNÍ ---
+
+BATCH_MAX = int(os.getenv("BATCH_MAX", 100000))
+BATCH_DAVKA = int(os.getenv("BATCH_DAVKA", 1000))  # kolik dotazů jde do db najednou
+
+class BatchDotaz(BaseModel):
+    query: str
+    search_type: Optional[str] = None
+
+class BatchSearch(BaseModel):
+    queries: List[Union[str, BatchDotaz]]
+    search_type: Optional[str] = None  # výchozí pro položky bez vlastního
+
+
+async def vyhodnotit_davku(cursor, dotazy):
+    """
+    dotazy = [(query, db_type_filter)]. Vrátí výsledky ve stejném pořadí.
+    Přesné shody jedním dotazem přes unnest(...) WITH ORDINALITY, fuzzy (LATERAL, top 5)
+    jen pro ty, které přesnou shodu nemají.
+    """
+    poradi, hodnoty, typy = [], [], []
+    normalizovane = []
+    for i, (query, db_type_filter) in enumerate(dotazy):
+        hledany_dotaz, hledane_hodnoty = pripravit_dotaz(query)
+        normalizovane.append(hledany_dotaz)
+        if not hledany_dotaz:
+            continue
+        for hodnota in hledane_hodnoty:
+            poradi.append(i)
+            hodnoty.append(hodnota)
+            typy.append(db_type_filter)
+
+    await cursor.execute("""
+        SELECT q.poradi, gl.nazev, i.value, i.type, gl.typ, gl.ltree_path
+        FROM unnest(%s::int[], %s::text[], %s::text[]) AS q(poradi, hodnota, typ)
+        JOIN ids i ON i.value = q.hodnota AND (q.typ IS NULL OR i.type = q.typ)
+        JOIN geo_locations gl ON i.location_pk = gl.pk_id
+        ORDER BY q.poradi, i.priority DESC;
+    """, (poradi, hodnoty, typy))
+    presne = {}
+    for row in await cursor.fetchall():
+        presne.setdefault(row[0], []).append(row[1:] + (None,))
+
+    chybi = [i for i in range(len(dotazy)) if i not in presne and normalizovane[i]]
+    fuzzy = {}
+    # jeden LATERAL dotaz na každý typ v dávce, aby se typ dal vložit jako literál (částečné indexy)
+    podle_typu = {}
+    for i in chybi:
+        podle_typu.setdefault(dotazy[i][1], []).append(i)
+    for db_type_filter, poradi_typu in podle_typu.items():
+        await cursor.execute(f"""
+            SELECT q.poradi, gl.nazev, k.value, k.type, gl.typ, gl.ltree_path, k.vzdalenost
+            FROM unnest(%s::int[], %s::text[]) AS q(poradi, hodnota)
+            CROSS JOIN LATERAL (
+                SELECT * FROM ({sql_fuzzy_kandidati(db_type_filter, "q.hodnota")}) kandidati
+                ORDER BY vzdalenost ASC, priority DESC
+                LIMIT 5
+            ) k
+            JOIN geo_locations gl ON k.location_pk = gl.pk_id
+            ORDER BY q.poradi, k.vzdalenost ASC, k.priority DESC;
+        """, (poradi_typu, [normalizovane[i] for i in poradi_typu]))
+        for row in await cursor.fetchall():
+            if round((1 - row[6]) * 100, 2) >= 10:
+                fuzzy.setdefault(row[0], []).append(row[1:])
+
+    cesty = await sestavit_cesty(cursor, [r[4] for rows in (presne, fuzzy) for v in rows.values() for r in v])
+
+    vysledky = []
+    for i, (query, db_type_filter) in enumerate(dotazy):
+        radky = presne.get(i) or fuzzy.get(i) or []
+        status = "exact_match" if i in presne else ("fuzzy_match" if radky else "not_found")
+        vysledky.append({
+            "query": query,
+            "status": status,
+            "filter": db_type_filter if db_type_filter else "all",
+            "results": [{
+                "obec": nazev,
+                "kod": kod,
+                "typ": typ_kodu,
+                "typ_uzlu": typ_uzlu,
+                "shoda": "100 %" if vzdalenost is None else f"{round((1 - vzdalenost) * 100, 2)} %",
+                "cesta": cesty.get(ltree_cesta, "Kořenový uzel")
+            } for nazev, kod, typ_kodu, typ_uzlu, ltree_cesta, vzdalenost in radky]
         })
+    return vysledky
+
 
-    cursor.close()
-    conn.close()
+@app.post("/search/batch")
+async def search_batch(dotaz: BatchSearch, format: str = Query("json", regex="^(json|ndjson)$")):
+    """
+    Vyhledá víc hodnot najednou, výsledky jsou ve stejném pořadí jako vstup.
+    format=ndjson vrací po řádcích průběžně (po dávkách BATCH_DAVKA), vhodné pro velké dávky.
+    """
+    if len(dotaz.queries) > BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"Maximálně {BATCH_MAX} dotazů najednou.")
+
+    dotazy = []
+    for polozka in dotaz.queries:
+        if isinstance(polozka, str):
+            polozka = BatchDotaz(query=polozka)
+        search_type = (polozka.search_type or dotaz.search_type or '').lower()
+        if search_type and search_type not in TYPY_HLEDANI:
+            raise HTTPException(status_code=422, detail=f"Neznámý search_type '{search_type}' u dotazu '{polozka.query}'.")
+        dotazy.append((polozka.query, TYPY_HLEDANI.get(search_type)))
+
+    async def po_davkach():
+        # spojení jen na dobu jedné dávky, ať pomalý klient neblokuje pool
+        for start in range(0, len(dotazy), BATCH_DAVKA):
+            async with async_db_spojeni() as conn:
+                async with conn.cursor() as cursor:
+                    yield await vyhodnotit_davku(cursor, dotazy[start:start + BATCH_DAVKA])
+
+    if format == "ndjson":
+        async def radky():
+            async for vysledky in po_davkach():
+                yield "".join(json.dumps(v, ensure_ascii=False) + "\n" for v in vysledky)
+        return StreamingResponse(radky(), media_type="application/x-ndjson")
+
+    vysledky = []
+    async for davka in po_davkach():
+        vysledky.extend(davka)
+    return {
+        "count": len(vysledky),
+        "nalezeno": sum(1 for v in vysledky if v["status"] != "not_found"),
+        "results": vysledky
+    }
+
+# --- EXPORT CELÉHO STROMU ---
+
+EXPORT_DAVKA = int(os.getenv("EXPORT_DAVKA", 5000))  # řádků na jedno fetchmany ze server-side kurzoru (= row group v Parquetu)
+EXPORT_FORMATY = {
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+EXPORT_CSV_HLAVICKA = ["pk_id", "parent_id", "typ", "nazev", "ltree_path", "id_type", "id_value", "id_priority"]
+
+
+def sql_exportu(podstrom, typ, typ_id):
+    """Uzly seřazené podle cesty (rodič vždy před potomky), identifikátory jako JSON pole u každého uzlu."""
+    filtr_ids = "AND i.type = %(typ_id)s" if typ_id else ""
+    podminky = []
+    if podstrom:
+        podminky.append("gl.ltree_path <@ %(podstrom)s::ltree")
+    if typ:
+        podminky.append("gl.typ = %(typ)s")
+    if typ_id:
+        podminky.append("EXISTS (SELECT 1 FROM ids i WHERE i.location_pk = gl.pk_id AND i.type = %(typ_id)s)")
+    where = ("WHERE " + " AND ".join(podminky)) if podminky else ""
+    return f"""
+        SELECT gl.pk_id, gl.parent_id, gl.typ, gl.nazev, gl.ltree_path::text,
+               COALESCE((
+                   SELECT json_agg(json_build_object('type', i.type, 'value', i.value, 'priority', i.priority)
+                                   ORDER BY i.type, i.value)
+                   FROM ids i
+                   WHERE i.location_pk = gl.pk_id {filtr_ids}
+               ), '[]'::json)
+        FROM geo_locations gl
+        {where}
+        ORDER BY gl.ltree_path;
+    """
+
+
+class ProudParquetu:
+    """Výstup pro ParquetWriter, ze kterého se průběžně odebírají zapsané bajty; tell() počítá celkovou pozici kvůli patičce."""
+
+    def __init__(self):
+        self._casti = []
+        self._pozice = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self._casti.append(data)
+        self._pozice += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._pozice
+
+    def flush(self):
+        pass
 
-    if not response_data:
-        raise HTTPException(status_code=404, detail="Nic dostatečně podobného nenalezeno.")
+    def close(self):
+        self.closed = True
 
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def odebrat(self):
+        data = b"".join(self._casti)
+        self._casti = []
+        return data
+
+
+def serializovat_ndjson(davka):
+    return "".join(
+        json.dumps({"pk_id": pk, "parent_id": parent, "typ": typ, "nazev": nazev, "ltree_path": cesta, "ids": ids},
+                   ensure_ascii=False) + "\n"
+        for pk, parent, typ, nazev, cesta, ids in davka
+    )
+
+
+def serializovat_csv(davka, s_hlavickou):
+    # jeden řádek na dvojici uzel-identifikátor, uzel bez identifikátorů má sloupce id_* prázdné
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if s_hlavickou:
+        writer.writerow(EXPORT_CSV_HLAVICKA)
+    for pk, parent, typ, nazev, cesta, ids in davka:
+        if not ids:
+            writer.writerow([pk, parent, typ, nazev, cesta, None, None, None])
+        for ident in ids:
+            writer.writerow([pk, parent, typ, nazev, cesta, ident["type"], ident["value"], ident["priority"]])
+    return buffer.getvalue()
+
+
+@app.get("/export")
+async def export(
+    format: str = Query("ndjson", regex="^(ndjson|csv|parquet)$"),
+    podstrom: str = Query(None, description="kód uzlu (libovolný identifikátor), exportuje se jen jeho podstrom"),
+    typ: str = Query(None, regex="^(KRAJ|OKRES|OBEC|MESTSKA_CAST|CAST_OBCE)$"),
+    typ_id: str = Query(None, description="jen identifikátory tohoto typu (např. LAU2) a uzly, které ho mají")
+):
+    """
+    Streamuje strom lokací i s identifikátory (NDJSON, CSV nebo Parquet).
+    Čte se server-side kurzorem po EXPORT_DAVKA řádcích, takže paměť nezávisí na velikosti exportu.
+    NDJSON a Parquet mají identifikátory jako pole u uzlu, CSV má řádek na každý identifikátor.
+    """
+    typ_id = typ_id.upper() if typ_id else None
+    pa = pq = None
+    if format == "parquet":
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise HTTPException(status_code=400, detail="Export do Parquetu potřebuje balíček pyarrow, který není nainstalovaný.")
+
+    cesta_podstromu = None
+    if podstrom:
+        async with async_db_spojeni() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute("""
+                    SELECT gl.ltree_path::text
+                    FROM ids i
+                    JOIN geo_locations gl ON i.location_pk = gl.pk_id
+                    WHERE i.value = %s
+                    LIMIT 1;
+                """, (podstrom,))
+                row = await cursor.fetchone()
+        if not row:
+            raise HTTPException(status_code=404, detail=f"Uzel s kódem '{podstrom}' nebyl nalezen.")
+        cesta_podstromu = row[0]
+
+    sql = sql_exportu(cesta_podstromu, typ, typ_id)
+    parametry = {"podstrom": cesta_podstromu, "typ": typ, "typ_id": typ_id}
+
+    async def davky():
+        # pojmenovaný kurzor = server-side, drží spojení (a transakci) po celou dobu exportu
+        async with async_db_spojeni() as conn:
+            async with conn.cursor(name="export") as cursor:
+                await cursor.execute(sql, parametry)
+                while True:
+                    davka = await cursor.fetchmany(EXPORT_DAVKA)
+                    if not davka:
+                        break
+                    yield davka
+            await conn.rollback()
+
+    async def proud_ndjson():
+        async for davka in davky():
+            yield serializovat_ndjson(davka)
+
+    async def proud_csv():
+        prvni = True
+        async for davka in davky():
+            yield serializovat_csv(davka, prvni)
+            prvni = False
+        if prvni:
+            yield serializovat_csv([], True)
+
+    async def proud_parquet():
+        schema = pa.schema([
+            ("pk_id", pa.int64()),
+            ("parent_id", pa.int64()),
+            ("typ", pa.string()),
+            ("nazev", pa.string()),
+            ("ltree_path", pa.string()),
+            ("ids", pa.list_(pa.struct([("type", pa.string()), ("value", pa.string()), ("priority", pa.int32())]))),
+        ])
+        vystup = ProudParquetu()
+        writer = pq.ParquetWriter(vystup, schema)
+        async for davka in davky():
+            sloupce = list(zip(*davka))
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(sloupec, type=pole.type) for sloupec, pole in zip(sloupce, schema)], schema=schema
+            ))
+            yield vystup.odebrat()
+        writer.close()
+        yield vystup.odebrat()
+
+    media_type, pripona = EXPORT_FORMATY[format]
+    proud = {"ndjson": proud_ndjson, "csv": proud_csv, "parquet": proud_parquet}[format]()
+    return StreamingResponse(proud, media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="export.{pripona}"'})
+
+# --- METRIKY ---
+
+@app.get("/metrics")
+def prometheus_metrics():
+    """Metriky pro Prometheus (histogramy fází a výsledků /search)."""
+    return PlainTextResponse(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.get("/metrics/pool")
+def pool_metrics():
+    """Stav poolů spojení: loader (psycopg2) a requesty (async psycopg 3) - vypůjčená/čekající spojení, latence."""
+    if db_pool is None and async_pool is None:
+        raise HTTPException(status_code=503, detail="Pool spojení ještě není inicializován.")
     return {
-        "status": "fuzzy_match",
-        "filter": db_type_filter if db_type_filter else "all",
-        "results": response_data
-    }
\ No newline at end of file
+        "loader": db_pool.metriky() if db_pool is not None else None,
+        "requesty": async_pool.get_stats() if async_pool is not None else None,
+    }
+
+
+@app.get("/metrics/index")
+def index_metrics():
+    """Stav in-memory indexu identifikátorů (režim jen pro čtení)."""
+    return id_index.metriky()
+
+
+@app.get("/metrics/suggest")
+def suggest_metrics():
+    """Velikost polí našeptávače a počet zapamatovaných krátkých prefixů."""
+    return naseptavac.metriky()
+
+
+@app.get("/metrics/cache")
+def cache_metrics():
+    """Cache odpovědí search_id: obsazenost, zásahy/minutí, vypršelé a zneplatněné položky."""
+    return odpovedi_cache.metriky()
+
+
+@app.get("/metrics/strom")
+def strom_metrics():
+    """Velikost cache horní části stromu a počty zásahů/minutí při skládání cest."""
+    return strom_cache.metriky()
+
+
+if __name__ == "__main__":
+    # python main.py snapshot [soubor] - projde CSV z tabulky/, srovná db a zkompiluje ji do snapshotu
+    if len(sys.argv) >= 2 and sys.argv[1] == "snapshot":
+        cesta = sys.argv[2] if len(sys.argv) >= 3 else SNAPSHOT_SOUBOR
+        inicializovat_pool()
+        with db_spojeni() as conn:
+            cursor = conn.cursor()
+            inicializovat_db(cursor, pouzit_snapshot=False)
+            conn.commit()
+            zacatek = time.perf_counter()
+            hlavicka = vytvorit_snapshot(cursor, cesta)
+            cursor.close()
+        print(f"Snapshot {cesta} ({os.path.getsize(cesta) // 1024} kB) vytvořen za {time.perf_counter() - zacatek:.2f} s:")
+        for sekce in hlavicka["sekce"]:
+            print(f"  {sekce['tabulka']}: {sekce['radku']} řádků")
+    else:
+        print("Použití: python main.py snapshot [soubor]")
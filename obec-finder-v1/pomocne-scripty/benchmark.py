@@ -0,0 +1,255 @@
+"""
+Benchmark vyhledávacích cest /search/{query}.
+
+Aplikace běží přímo v procesu (httpx ASGITransport, bez sítě) nad lokálním
+Postgresem z DB_HOST/DB_NAME/DB_USER/DB_PASS, nebo nad dočasnou instancí,
+kterou si skript sám spustí (--docasna-db, potřebuje initdb a pg_ctl).
+Prázdná db se naplní z tabulky/ stejně jako při startu aplikace.
+
+Příklad:
+    python benchmark.py --docasna-db --pocet 2000 --vystup vysledky.json
+    python benchmark.py --porovnat vysledky.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+KOREN_APLIKACE = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+# --- DOČASNÁ DB ---
+
+class DocasnaDb:
+    """Postgres v dočasném adresáři (initdb + pg_ctl), po skončení se smaže."""
+
+    def __init__(self, pg_bin=None):
+        self.pg_bin = pg_bin
+        self.adresar = tempfile.mkdtemp(prefix='obec-bench-')
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            self.port = s.getsockname()[1]
+
+    def _prikaz(self, nazev):
+        cesta = os.path.join(self.pg_bin, nazev) if self.pg_bin else shutil.which(nazev)
+        if not cesta:
+            raise SystemExit(f"Nenalezen {nazev}, nastavte --pg-bin nebo použijte existující db.")
+        return cesta
+
+    def spustit(self):
+        data = os.path.join(self.adresar, 'data')
+        subprocess.run([self._prikaz('initdb'), '-D', data, '-U', 'student', '--auth=trust', '-E', 'UTF8'],
+                       check=True, stdout=subprocess.DEVNULL)
+        subprocess.run([self._prikaz('pg_ctl'), '-D', data, '-l', os.path.join(self.adresar, 'log'), '-w',
+                        '-o', f"-p {self.port} -k {self.adresar} -c listen_addresses=127.0.0.1", 'start'],
+                       check=True, stdout=subprocess.DEVNULL)
+        subprocess.run([self._prikaz('createdb'), '-h', self.adresar, '-p', str(self.port), '-U', 'student', 'obce_bench'],
+                       check=True)
+        os.environ.update(DB_HOST='127.0.0.1', DB_NAME='obce_bench', DB_USER='student', DB_PASS='')
+        os.environ['PGPORT'] = str(self.port)
+        print(f"Dočasná db běží na portu {self.port} ({self.adresar}).")
+
+    def zastavit(self):
+        subprocess.run([self._prikaz('pg_ctl'), '-D', os.path.join(self.adresar, 'data'), '-m', 'fast', 'stop'],
+                       stdout=subprocess.DEVNULL)
+        shutil.rmtree(self.adresar, ignore_errors=True)
+
+
+# --- MIXY DOTAZŮ ---
+
+def preklep(hodnota, rnd):
+    """Jedna chyba v kódu: záměna, vypuštění nebo přehození sousedních znaků."""
+    i = rnd.randrange(len(hodnota))
+    druh = rnd.choice(('zamena', 'vypusteni', 'prehozeni')) if len(hodnota) > 2 else 'zamena'
+    if druh == 'zamena':
+        return hodnota[:i] + rnd.choice('0123456789') + hodnota[i + 1:]
+    if druh == 'vypusteni':
+        return hodnota[:i] + hodnota[i + 1:]
+    i = min(i, len(hodnota) - 2)
+    return hodnota[:i] + hodnota[i + 1] + hodnota[i] + hodnota[i + 2:]
+
+
+def pripravit_scenare(cursor, pocet, seed):
+    """Vzorky hodnot z db; stejný seed dává stejné dotazy (pořadí přes md5, ne random())."""
+    rnd = random.Random(seed)
+
+    def vzorek(typ, podminka=''):
+        cursor.execute(
+            f"SELECT DISTINCT value, md5(value || %s) FROM ids WHERE type = %s {podminka} ORDER BY 2 LIMIT %s;",
+            (str(seed), typ, pocet)
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+    lau2 = vzorek('LAU2')
+    ico_s_nulami = [v.lstrip('0') for v in vzorek('ICO', "AND value LIKE '00%%'")]
+    cursor.execute("""
+        SELECT value FROM ids WHERE type = 'PSC'
+        GROUP BY value ORDER BY count(*) DESC, value LIMIT %s;
+    """, (pocet,))
+    psc = [row[0] for row in cursor.fetchall()]
+    preklepy = [preklep(v, rnd) for v in lau2]
+
+    return {
+        # nazev: ([dotazy], search_type)
+        "exact_lau2": (lau2, 'lau2'),
+        "exact_lau2_bez_filtru": (lau2, None),
+        "ico_doplneni_nul": (ico_s_nulami, 'ico'),
+        "psc_fanout": (psc, 'psc'),
+        "fuzzy_preklep_lau2": (preklepy, 'lau2'),
+        "fuzzy_preklep_bez_filtru": (preklepy, None),
+    }
+
+
+# --- MĚŘENÍ ---
+
+def percentil(serazene, p):
+    if not serazene:
+        return None
+    return serazene[min(len(serazene) - 1, int(round(p / 100 * (len(serazene) - 1))))]
+
+
+async def zmerit(klient, dotazy, search_type, pocet, soubeznost, zahrati):
+    params = {'search_type': search_type} if search_type else {}
+    dotazy = [dotazy[i % len(dotazy)] for i in range(pocet)]
+
+    for dotaz in dotazy[:zahrati]:
+        await klient.get(f"/search/{dotaz}", params=params)
+
+    latence = []
+    vysledky = {}
+    fronta = iter(dotazy)
+
+    async def pracovnik():
+        for dotaz in fronta:
+            zacatek = time.perf_counter()
+            r = await klient.get(f"/search/{dotaz}", params=params)
+            latence.append((time.perf_counter() - zacatek) * 1000)
+            stav = r.json().get("status", "not_found") if r.status_code in (200, 404) else f"http_{r.status_code}"
+            vysledky[stav] = vysledky.get(stav, 0) + 1
+
+    zacatek = time.perf_counter()
+    await asyncio.gather(*(pracovnik() for _ in range(soubeznost)))
+    trvani = time.perf_counter() - zacatek
+
+    latence.sort()
+    return {
+        "search_type": search_type,
+        "pozadavku": len(latence),
+        "propustnost_rps": round(len(latence) / trvani, 1),
+        "p50_ms": round(percentil(latence, 50), 3),
+        "p95_ms": round(percentil(latence, 95), 3),
+        "p99_ms": round(percentil(latence, 99), 3),
+        "max_ms": round(latence[-1], 3),
+        "vysledky": vysledky,
+    }
+
+
+async def spustit_benchmark(args):
+    os.chdir(KOREN_APLIKACE)   # aplikace čte tabulky/ relativně
+    sys.path.insert(0, KOREN_APLIKACE)
+    if not args.s_cache:
+        os.environ['CACHE_VELIKOST'] = '0'   # měří se cesta do db, ne cache odpovědí
+    import main
+
+    zacatek = time.perf_counter()
+    main.startup_db()
+    await main.startup_async_pool()
+    print(f"Aplikace připravena za {time.perf_counter() - zacatek:.1f} s.")
+
+    try:
+        with main.db_spojeni() as conn:
+            cursor = conn.cursor()
+            scenare = pripravit_scenare(cursor, args.vzorku, args.seed)
+            cursor.close()
+
+        vysledek = {
+            "vytvoreno": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": git_commit(),
+            "parametry": {k: v for k, v in vars(args).items() if k not in ('vystup', 'porovnat')},
+            "scenare": {},
+        }
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as klient:
+            for nazev, (dotazy, search_type) in scenare.items():
+                if args.jen and nazev not in args.jen:
+                    continue
+                if not dotazy:
+                    print(f"{nazev}: v db nejsou data, přeskakuji.")
+                    continue
+                mereni = await zmerit(klient, dotazy, search_type, args.pocet, args.soubeznost, args.zahrati)
+                vysledek["scenare"][nazev] = mereni
+                print(f"{nazev:26} {mereni['propustnost_rps']:>8} req/s  p50 {mereni['p50_ms']:>7} ms  "
+                      f"p95 {mereni['p95_ms']:>7} ms  p99 {mereni['p99_ms']:>7} ms  {mereni['vysledky']}")
+        return vysledek
+    finally:
+        await main.shutdown_async_pool()
+        main.shutdown_db()
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=KOREN_APLIKACE,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def porovnat(stary, novy):
+    """Vypíše změnu propustnosti a latencí proti dřívějšímu běhu."""
+    print(f"\nPorovnání s {stary['vytvoreno']} (commit {stary.get('commit')}):")
+    for nazev, mereni in novy["scenare"].items():
+        puvodni = stary["scenare"].get(nazev)
+        if not puvodni:
+            continue
+        zmeny = []
+        for klic in ('propustnost_rps', 'p50_ms', 'p95_ms', 'p99_ms'):
+            if puvodni[klic]:
+                zmeny.append(f"{klic} {(mereni[klic] / puvodni[klic] - 1) * 100:+.1f} %")
+        print(f"  {nazev:26} " + ", ".join(zmeny))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark /search/{query} nad lokální nebo dočasnou db.")
+    parser.add_argument('--docasna-db', action='store_true', help="spustit vlastní Postgres v dočasném adresáři")
+    parser.add_argument('--pg-bin', help="adresář s initdb/pg_ctl/createdb (jinak z PATH)")
+    parser.add_argument('--pocet', type=int, default=1000, help="požadavků na scénář")
+    parser.add_argument('--vzorku', type=int, default=500, help="různých hodnot na scénář")
+    parser.add_argument('--soubeznost', type=int, default=8)
+    parser.add_argument('--zahrati', type=int, default=50, help="požadavků na zahřátí před měřením")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--s-cache', action='store_true', help="nechat zapnutou cache odpovědí")
+    parser.add_argument('--jen', nargs='*', help="spustit jen vybrané scénáře")
+    parser.add_argument('--vystup', help="uložit výsledky jako JSON")
+    parser.add_argument('--porovnat', help="JSON z dřívějšího běhu pro porovnání")
+    args = parser.parse_args()
+
+    if args.vystup:
+        args.vystup = os.path.abspath(args.vystup)
+    if args.porovnat:
+        args.porovnat = os.path.abspath(args.porovnat)
+
+    db = DocasnaDb(args.pg_bin) if args.docasna_db else None
+    if db:
+        db.spustit()
+    try:
+        vysledek = asyncio.run(spustit_benchmark(args))
+    finally:
+        if db:
+            db.zastavit()
+
+    if args.vystup:
+        with open(args.vystup, 'w', encoding='utf-8') as f:
+            json.dump(vysledek, f, ensure_ascii=False, indent=2)
+        print(f"Výsledky uloženy do {args.vystup}.")
+    if args.porovnat:
+        with open(args.porovnat, 'r', encoding='utf-8') as f:
+            porovnat(json.load(f), vysledek)
@@ -1,13 +1,26 @@
+import argparse
 import csv
-import requests
-import time
+import os
+import random
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from requests.adapters import HTTPAdapter
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120.0.0.0'
+}
+VZOR_ID = re.compile(r'vyhledat-([0-9]+)\.htm', re.IGNORECASE)
+
 
 def vytvor_slovnik_zuj():
     """Načte ZUJ kódy a jejich názvy."""
     zuj_dict = {}
     print("Načítám naše ZUJ kódy a názvy (LAU2 a MOMC)...")
-    
+
     # Načtení Obcí
     try:
         with open('../tabulky/VAZ0043_0101_CS.csv', 'r', encoding='utf-8') as f:
@@ -18,7 +31,7 @@ def vytvor_slovnik_zuj():
                 nazev = row[5].strip()
                 zuj_dict[zuj] = nazev
     except Exception as e: print("Chyba čtení VAZ0043:", e)
-        
+
     # Načtení Městských částí
     try:
         with open('../tabulky/VAZ0044_0043_CS-2.csv', 'r', encoding='utf-8') as f:
@@ -29,57 +42,165 @@ def vytvor_slovnik_zuj():
                 nazev = row[5].strip()
                 zuj_dict[zuj] = nazev
     except Exception as e: print("Chyba čtení VAZ0044:", e)
-        
+
     return zuj_dict
 
-def stahni_ids():
+
+class RateLimit:
+    """Společný limit pro všechna vlákna: mezi dvěma požadavky je aspoň 1/rychlost sekundy."""
+
+    def __init__(self, pozadavku_za_s):
+        self.interval = 1.0 / pozadavku_za_s if pozadavku_za_s > 0 else 0
+        self._dalsi = time.monotonic()
+        self._zamek = threading.Lock()
+
+    def pockej(self):
+        with self._zamek:
+            ted = time.monotonic()
+            start = max(ted, self._dalsi)
+            self._dalsi = start + self.interval
+        if start > ted:
+            time.sleep(start - ted)
+
+
+class Checkpoint:
+    """
+    Průběžný zápis výsledků (zuj;id_mesta_obce) na disk. Prázdné id znamená,
+    že web profil nemá - i to je hotová odpověď a znovu se nestahuje.
+    Chyby spojení se nezapisují, takže je příští běh zkusí znovu.
+    """
+
+    def __init__(self, cesta):
+        self.cesta = cesta
+        self.hotovo = {}
+        self._zamek = threading.Lock()
+
+        if os.path.exists(cesta):
+            with open(cesta, 'r', encoding='utf-8') as f:
+                for row in csv.reader(f, delimiter=';'):
+                    if len(row) == 2:
+                        self.hotovo[row[0]] = row[1]
+
+        self._soubor = open(cesta, 'a', newline='', encoding='utf-8')
+        self._writer = csv.writer(self._soubor, delimiter=';')
+
+    def zapsat(self, zuj, id_webu):
+        with self._zamek:
+            self.hotovo[zuj] = id_webu or ''
+            self._writer.writerow([zuj, id_webu or ''])
+            self._soubor.flush()
+
+    def zavrit(self):
+        self._soubor.close()
+
+
+_vlakna = threading.local()
+
+def session_vlakna():
+    """Každé vlákno má svoji Session (keep-alive spojení se mezi požadavky znovu používá)."""
+    session = getattr(_vlakna, 'session', None)
+    if session is None:
+        session = requests.Session()
+        session.headers.update(HEADERS)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        _vlakna.session = session
+    return session
+
+
+def zjisti_id(zuj, base_url, limit, timeout, pokusu):
+    """
+    Vrátí id z přesměrování na vyhledat-<id>.htm, None pokud web profil nemá.
+    Při chybě spojení / 429 / 5xx to zkouší znovu s rostoucí pauzou, pak vyhodí výjimku.
+    """
+    url = f"{base_url}/vyhledat.asp?zuj={zuj}"
+    session = session_vlakna()
+
+    for pokus in range(pokusu):
+        limit.pockej()
+        try:
+            response = session.get(url, allow_redirects=True, timeout=timeout)
+            if response.status_code == 429 or response.status_code >= 500:
+                raise requests.HTTPError(f"HTTP {response.status_code}", response=response)
+
+            shoda = VZOR_ID.search(response.url)
+            return shoda.group(1) if shoda else None
+
+        except requests.RequestException:
+            if pokus == pokusu - 1:
+                raise
+            time.sleep(min(30, 0.5 * 2 ** pokus) + random.uniform(0, 0.25))
+
+
+def zjisti_a_zapis(zuj, checkpoint, base_url, limit, timeout, pokusu):
+    """Běží ve vlákně: výsledek jde do checkpointu hned, ne až přes hlavní vlákno."""
+    id_webu = zjisti_id(zuj, base_url, limit, timeout, pokusu)
+    checkpoint.zapsat(zuj, id_webu)
+    return id_webu
+
+
+def stahni_ids(base_url="https://mesta.obce.cz", vlaken=4, rychlost=6.0, timeout=10, pokusu=4,
+               checkpoint_soubor='mesta_obce_checkpoint.csv',
+               vystup='../tabulky/mesta_obce_id.csv', log_soubor='chybejici_mesta_obce.txt'):
     zuj_map = vytvor_slovnik_zuj()
-    print(f"Nalezeno {len(zuj_map)} unikátních uzlů k prověření.")
-    print("Začínám stahovat IDs... (trva asi 1,5h)")
-    
-    vysledky = []
-    chybejici_log = []
-    
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120.0.0.0'
-    }
-    
+    checkpoint = Checkpoint(checkpoint_soubor)
+    k_stazeni = [zuj for zuj in zuj_map if zuj not in checkpoint.hotovo]
+
+    print(f"Nalezeno {len(zuj_map)} unikátních uzlů k prověření, z checkpointu hotovo {len(zuj_map) - len(k_stazeni)}.")
+    print(f"Začínám stahovat {len(k_stazeni)} IDs ({vlaken} vláken, max {rychlost} požadavků/s)...")
+
+    limit = RateLimit(rychlost)
     zpracovano = 0
-    for zuj, nazev in zuj_map.items():
-        zpracovano += 1
-        url = f"https://mesta.obce.cz/vyhledat.asp?zuj={zuj}"
-        uspech = False
-        
-        try:
-            response = requests.get(url, headers=headers, allow_redirects=True, timeout=10)
-            shoda = re.search(r'vyhledat-([0-9]+)\.htm', response.url, re.IGNORECASE)
-            
-            if shoda:
-                id_webu = shoda.group(1)
-                vysledky.append([zuj, id_webu])
-                uspech = True
-                
-        except Exception as e:
-            pass # timeouty a pády spojení vyřešíme tím, že uspech zůstane False
-        
-        # není ID v adrese, nebo spadlo spojení
-        if not uspech:
-            chybejici_log.append(f"ZUJ: {zuj.zfill(6)} | Uzel: {nazev}")
-        
-        time.sleep(0.15)
-        
-        if zpracovano % 100 == 0:
-            print(f" Zpracováno {zpracovano} z {len(zuj_map)}. Získáno: {len(vysledky)} | Nenalezeno: {len(chybejici_log)}")
+    chyb_spojeni = 0
+    jinych_chyb = 0
+
+    executor = ThreadPoolExecutor(max_workers=vlaken)
+    try:
+        futures = {
+            executor.submit(zjisti_a_zapis, zuj, checkpoint, base_url.rstrip('/'), limit, timeout, pokusu): zuj
+            for zuj in k_stazeni
+        }
+        for future in as_completed(futures):
+            zuj = futures[future]
+            zpracovano += 1
+            try:
+                future.result()
+            except requests.RequestException:
+                # nezapisuje se - příští běh to zkusí znovu
+                chyb_spojeni += 1
+            except Exception as e:
+                # jedna divná stránka nesmí shodit celý běh, příští běh ji zkusí znovu
+                jinych_chyb += 1
+                print(f" Chyba u ZUJ {zuj}: {e!r}")
+
+            if zpracovano % 100 == 0:
+                print(f" Zpracováno {zpracovano} z {len(k_stazeni)}. Chyby spojení: {chyb_spojeni}, jiné chyby: {jinych_chyb}")
+    except BaseException:
+        # Ctrl-C apod.: zbytek fronty se zahodí, rozběhnuté požadavky doběhnou a zapíšou se do checkpointu
+        print("\nPřerušeno, ukládám rozpracované a končím (příští běh naváže z checkpointu).")
+        executor.shutdown(wait=True, cancel_futures=True)
+        raise
+    else:
+        executor.shutdown()
+    finally:
+        checkpoint.zavrit()
+
+    vysledky = [[zuj, checkpoint.hotovo[zuj]] for zuj in zuj_map if checkpoint.hotovo.get(zuj)]
+    chybejici_log = [
+        f"ZUJ: {zuj.zfill(6)} | Uzel: {nazev}"
+        for zuj, nazev in zuj_map.items() if not checkpoint.hotovo.get(zuj)
+    ]
 
     # ÚSPĚŠNE DATA (CSV)
-    with open('../tabulky/mesta_obce_id.csv', 'w', newline='', encoding='utf-8') as f:
+    with open(vystup, 'w', newline='', encoding='utf-8') as f:
         writer = csv.writer(f, delimiter=';')
         writer.writerow(['zuj', 'id_mesta_obce'])
         writer.writerows(vysledky)
-        
+
     # CHYBOVÉHO LOG
     if chybejici_log:
-        with open('chybejici_mesta_obce.txt', 'w', encoding='utf-8') as f_log:
+        with open(log_soubor, 'w', encoding='utf-8') as f_log:
             f_log.write(f"Záznamy ({len(chybejici_log)}), které nemají svůj profil na mesta.obce.cz:\n")
             f_log.write("-" * 80 + "\n")
             for chyba in chybejici_log:
@@ -87,7 +208,19 @@ def stahni_ids():
 
     print("\n--- REPORT ---")
     print(f"Úspěšně získáno a uloženo do CSV: {len(vysledky)} IDs.")
-    print(f"Nepodařilo se nalézt: {len(chybejici_log)} uzlů (seznam uložen do 'chybejici_mesta_obce.txt').")
+    print(f"Nepodařilo se nalézt: {len(chybejici_log)} uzlů (seznam uložen do '{log_soubor}').")
+    if chyb_spojeni or jinych_chyb:
+        print(f"Z toho {chyb_spojeni + jinych_chyb} kvůli chybě (spojení: {chyb_spojeni}, jiné: {jinych_chyb}) - po novém spuštění se stáhnou jen ty.")
 
 if __name__ == "__main__":
-    stahni_ids()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Stáhne ID profilů z mesta.obce.cz podle ZUJ kódů.")
+    parser.add_argument('--base-url', default="https://mesta.obce.cz", help="např. lokální stub z mesta.obce-stub.py: http://127.0.0.1:8080")
+    parser.add_argument('--vlaken', type=int, default=4)
+    parser.add_argument('--rychlost', type=float, default=6.0, help="max. požadavků za sekundu (všechna vlákna dohromady)")
+    parser.add_argument('--timeout', type=float, default=10)
+    parser.add_argument('--pokusu', type=int, default=4)
+    parser.add_argument('--checkpoint', default='mesta_obce_checkpoint.csv')
+    parser.add_argument('--vystup', default='../tabulky/mesta_obce_id.csv')
+    args = parser.parse_args()
+
+    stahni_ids(args.base_url, args.vlaken, args.rychlost, args.timeout, args.pokusu, args.checkpoint, args.vystup)
@@ -0,0 +1,60 @@
+"""
+Lokální náhrada mesta.obce.cz pro zkoušení scraperu bez zatěžování webu.
+
+vyhledat.asp?zuj=<kód> přesměruje na vyhledat-<id>.htm (id = zuj + 1), každý
+--bez-profilu-tý kód přesměruje jinam (obec bez profilu) a s pravděpodobností
+--chyby odpoví 503, aby se projevily opakované pokusy a checkpoint.
+
+Příklad:
+    python mesta.obce-stub.py --port 8080 --chyby 0.05
+    python mesta.obce-scraper.py --base-url http://127.0.0.1:8080 --rychlost 200 \
+        --checkpoint /tmp/checkpoint.csv --vystup /tmp/mesta_obce_id.csv
+"""
+import argparse
+import random
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    chyby = 0.0
+    bez_profilu = 7
+
+    def log_message(self, *args):
+        pass
+
+    def odpovedet(self, status, location=None, telo=b''):
+        self.send_response(status)
+        if location:
+            self.send_header('Location', location)
+        self.send_header('Content-Length', str(len(telo)))
+        self.end_headers()
+        self.wfile.write(telo)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != '/vyhledat.asp':
+            return self.odpovedet(200, telo=b'ok')
+
+        zuj = parse_qs(url.query).get('zuj', [''])[0]
+        if not zuj.isdigit():
+            return self.odpovedet(400)
+        if random.random() < self.chyby:
+            return self.odpovedet(503)
+        if int(zuj) % self.bez_profilu == 0:
+            return self.odpovedet(302, '/nenalezeno.htm')
+        return self.odpovedet(302, f'/vyhledat-{int(zuj) + 1}.htm')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Lokální stub mesta.obce.cz pro mesta.obce-scraper.py.")
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--chyby', type=float, default=0.0, help="podíl odpovědí 503 (0-1)")
+    parser.add_argument('--bez-profilu', type=int, default=7, help="každý n-tý ZUJ kód nemá profil")
+    args = parser.parse_args()
+
+    StubHandler.chyby = args.chyby
+    StubHandler.bez_profilu = args.bez_profilu
+    print(f"Stub mesta.obce.cz běží na http://127.0.0.1:{args.port}")
+    ThreadingHTTPServer(('127.0.0.1', args.port), StubHandler).serve_forever()
@@ -2,12 +2,74 @@ import time
 import csv
 import os
 import psycopg2
+from psycopg2.extras import execute_values
 from fastapi import FastAPI, HTTPException
 from typing import List, Dict
 import Levenshtein
 
 app = FastAPI()
 
+MAX_VZDALENOST = 3
+
+
+class FuzzyIndex:
+    """
+    Index kódů pro hledání do vzdálenosti MAX_VZDALENOST (princip SymSpell).
+    Ke každému kódu se předem uloží všechny varianty s až N vymazanými znaky;
+    dotaz pak vygeneruje svoje varianty a Levenshtein se počítá jen pro
+    kandidáty se společnou variantou - ne pro všechny obce.
+    """
+
+    def __init__(self, max_vzdalenost=MAX_VZDALENOST):
+        self.max_vzdalenost = max_vzdalenost
+        self.varianty = {}
+        self.obce = []
+        self.max_delka = 0
+
+    def _varianty(self, slovo):
+        vysledek = {slovo}
+        vrstva = {slovo}
+        for _ in range(self.max_vzdalenost):
+            vrstva = {v[:i] + v[i + 1:] for v in vrstva for i in range(len(v))}
+            vysledek |= vrstva
+        return vysledek
+
+    def postavit(self, radky):
+        self.varianty = {}
+        self.obce = list(radky)
+        self.max_delka = 0
+        for poradi, (lau2, _) in enumerate(self.obce):
+            self.max_delka = max(self.max_delka, len(lau2))
+            for varianta in self._varianty(lau2):
+                self.varianty.setdefault(varianta, []).append(poradi)
+
+    def hledat(self, dotaz, limit=5):
+        # delší dotaz nemůže mít k žádnému kódu vzdálenost <= max_vzdalenost
+        if len(dotaz) > self.max_delka + self.max_vzdalenost:
+            return []
+
+        kandidati = set()
+        for varianta in self._varianty(dotaz):
+            kandidati.update(self.varianty.get(varianta, ()))
+
+        nalezeno = []
+        for poradi in kandidati:
+            lau2, nazev = self.obce[poradi]
+            vzdalenost = Levenshtein.distance(dotaz, lau2)
+            if vzdalenost <= self.max_vzdalenost:
+                nalezeno.append((vzdalenost, poradi, lau2, nazev))
+
+        nalezeno.sort()
+        return [{"lau2": lau2, "mesto": nazev, "dist": vzdalenost} for vzdalenost, _, lau2, nazev in nalezeno[:limit]]
+
+
+fuzzy_index = FuzzyIndex()
+
+def postavit_fuzzy_index(cursor):
+    cursor.execute("SELECT lau2, nazev FROM obce ORDER BY id")
+    fuzzy_index.postavit(cursor.fetchall())
+    print(f"Fuzzy index postaven ({len(fuzzy_index.obce)} kódů, {len(fuzzy_index.varianty)} variant).")
+
 def get_db_connection():
     return psycopg2.connect(
         host=os.getenv("DB_HOST"),
@@ -16,19 +78,49 @@ def get_db_connection():
         password=os.getenv("DB_PASS")
     )
 
-@app.on_event("startup")
-def startup_db():
-    conn = None
-    for _ in range(10):
+DB_READY_TIMEOUT = float(os.getenv("DB_READY_TIMEOUT", "30"))
+VELIKOST_DAVKY = 1000
+
+data_pripravena = False
+
+def pockat_na_db():
+    """Zkouší se připojit s rostoucí pauzou (0,1 s .. 2 s), nejdéle DB_READY_TIMEOUT sekund."""
+    konec = time.monotonic() + DB_READY_TIMEOUT
+    pauza = 0.1
+    while True:
         try:
-            conn = get_db_connection()
-            print("Připojeno k db.")
-            break
+            return get_db_connection()
         except psycopg2.OperationalError:
+            if time.monotonic() + pauza > konec:
+                return None
             print("db startuje, čekám...")
-            time.sleep(2)
-    
-    if not conn: return
+            time.sleep(pauza)
+            pauza = min(pauza * 2, 2)
+
+def nahrat_obce(cursor, reader):
+    """Vkládá po dávkách přes execute_values a místo každého řádku vypisuje jen průběh."""
+    nahrano = 0
+    davka = []
+    for radek in reader:
+        davka.append((radek[3], radek[5]))
+        if len(davka) >= VELIKOST_DAVKY:
+            execute_values(cursor, "INSERT INTO obce (lau2, nazev) VALUES %s", davka, page_size=VELIKOST_DAVKY)
+            nahrano += len(davka)
+            davka = []
+            print(f" Nahráno {nahrano} řádků...")
+    if davka:
+        execute_values(cursor, "INSERT INTO obce (lau2, nazev) VALUES %s", davka, page_size=VELIKOST_DAVKY)
+        nahrano += len(davka)
+    return nahrano
+
+@app.on_event("startup")
+def startup_db():
+    global data_pripravena
+    conn = pockat_na_db()
+    if not conn:
+        print(f"Db není dostupná ani po {DB_READY_TIMEOUT:.0f} s.")
+        return
+    print("Připojeno k db.")
 
     cursor = conn.cursor()
     cursor.execute("""
@@ -47,21 +139,27 @@ def startup_db():
             with open('zuj-name.csv', 'r', encoding='utf-8') as f:
                 reader = csv.reader(f)
                 next(reader) 
-                for radek in reader:
-                    cursor.execute(
-                        "INSERT INTO obce (lau2, nazev) VALUES (%s, %s)",
-                        (radek[3], radek[5])
-                    )
-                    print(radek[3], radek[5])
+                nahrano = nahrat_obce(cursor, reader)
             conn.commit()
-            print("Data nahrána.")
+            print(f"Data nahrána ({nahrano} obcí).")
         except FileNotFoundError:
             print("Chyba: obce.csv nenalezen.")
+
+    postavit_fuzzy_index(cursor)
+    data_pripravena = True
     
     cursor.close()
     conn.close()
 
 
+@app.get("/ready")
+def ready():
+    """Pro healthcheck: 200 až jsou data nahraná a fuzzy index postavený."""
+    if not data_pripravena:
+        raise HTTPException(status_code=503, detail="Data se ještě nahrávají.")
+    return {"stav": "ok", "obci": len(fuzzy_index.obce)}
+
+
 @app.get("/city/{code_input}", response_model=List[Dict[str, str]])
 
 def find_smart_city(code_input: str):
@@ -77,36 +175,20 @@ def find_smart_city(code_input: str):
         conn.close()
         return [{"lau2": presna_shoda[0], "mesto": presna_shoda[1]}]
 
-    # fuzzy search
-    cursor.execute("SELECT lau2, nazev FROM obce")
-    vsechny_obce = cursor.fetchall()
-    
+    # fuzzy search přes index (nestahuje celou tabulku)
+    if not fuzzy_index.obce:
+        postavit_fuzzy_index(cursor)
+
     cursor.close()
     conn.close()
 
-
-    kandidati = []
-
-    for radek in vsechny_obce:
-        db_code = radek[0]
-        db_nazev = radek[1]
-        
-        vzdalenost = Levenshtein.distance(code_input, db_code)
-        
-        if vzdalenost <= 3:
-            kandidati.append({
-                "lau2": db_code,
-                "mesto": db_nazev,
-                "dist": vzdalenost
-            })
+    kandidati = fuzzy_index.hledat(code_input, limit=5)
 
     if not kandidati:
         raise HTTPException(status_code=404, detail="Nenalezeny žádné podobné kódy.")
 
-    kandidati_serazeni = sorted(kandidati, key=lambda x: x["dist"])
-
     vysledek = []
-    for k in kandidati_serazeni[:5]:
+    for k in kandidati:
         vysledek.append({"lau2": k["lau2"], "mesto": k["mesto"]})
 
     return vysledek
\ No newline at end of file